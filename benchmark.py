@@ -0,0 +1,224 @@
+#Benchmark de hora pico del flujo de Restaurante.
+#Construye un restaurante sintetico sobre SQLite (en memoria o en archivo), recorre
+#agregar_cliente -> asignar_mesa -> anotar_pedido -> atender_pedido -> mostrar_cuenta
+#y guarda tiempo y cantidad de consultas SQL por operacion en un archivo JSON.
+#Uso:
+#    python benchmark.py --app restaurante --base memoria archivo --salida benchmark.json
+#    python benchmark.py --app restaurante --comparar benchmark_anterior.json
+#Termina con codigo 1 si el p95 de consultas de alguna operacion (sin las llamadas de calentamiento)
+#supera su presupuesto.
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+#Llamadas iniciales de cada operacion que no cuentan para el presupuesto: cargan caches (menu, versiones,
+#bloques de Secuencia) y no representan el regimen estable de la hora pico.
+CALENTAMIENTO = 5
+
+#Presupuesto de consultas SQL por llamada (p95 despues del calentamiento):
+PRESUPUESTO_CONSULTAS = {
+    'agregar_cliente': 3,
+    'asignar_mesa': 7,
+    'anotar_pedido': 4,
+    'atender_pedido': 26,
+    'mostrar_cuenta': 20,
+}
+
+
+def configurar_django(base: str, apps: list):
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    nombre = ':memory:' if base == 'memoria' else os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': nombre}},
+        INSTALLED_APPS=['django.contrib.contenttypes', *apps],
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+        USE_TZ=True,
+    )
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+class Medidor:
+    def __init__(self):
+        self.muestras = defaultdict(list)
+
+    @contextlib.contextmanager
+    def medir(self, operacion: str):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as consultas, contextlib.redirect_stdout(io.StringIO()):
+            inicio = time.perf_counter()
+            yield
+            duracion = time.perf_counter() - inicio
+        self.muestras[operacion].append((duracion, len(consultas)))
+
+    def resumen(self) -> dict:
+        resumen = {}
+        for operacion, muestras in self.muestras.items():
+            tiempos = sorted(duracion for duracion, _ in muestras)
+            consultas = [cantidad for _, cantidad in muestras]
+            estables = sorted(consultas[CALENTAMIENTO:] or consultas)
+            resumen[operacion] = {
+                'llamadas': len(muestras),
+                'tiempo_total_s': sum(tiempos),
+                'tiempo_medio_ms': statistics.mean(tiempos) * 1000,
+                'tiempo_p95_ms': tiempos[int(0.95 * (len(tiempos) - 1))] * 1000,
+                'consultas_media': statistics.mean(consultas),
+                'consultas_max': max(consultas),
+                'consultas_p95': estables[int(0.95 * (len(estables) - 1))],
+            }
+        return resumen
+
+
+def construir_restaurante(app: str, mesas: int, meseros: int, cocineros: int, platos: int):
+    from django.apps import apps
+
+    Menu = apps.get_model(app, 'Menu')
+    Restaurante = apps.get_model(app, 'Restaurante')
+
+    menu = Menu.objects.create()
+    menu.agregar_platos(*[(f"Plato {i}", Decimal(5 + i % 20)) for i in range(platos)])
+    restaurante = Restaurante(nombre="Benchmark", menu=menu)
+    restaurante.save()
+    for i in range(mesas):
+        restaurante.agregar_mesa(2 + i % 5)
+    for i in range(meseros):
+        restaurante.agregar_mesero(f"Mesero {i}", f"M{i:09d}", f"M{i:09d}")
+    for i in range(cocineros):
+        restaurante.agregar_personal_cocina(f"Cocinero {i}", f"P{i:09d}", f"P{i:09d}")
+    return restaurante
+
+
+def hora_pico(app: str, restaurante, clientes: int, platos: int, medidor: 'Medidor'):
+    from django.apps import apps
+
+    Pedido = apps.get_model(app, 'Pedido')
+    for i in range(clientes):
+        cedula = f"C{i:09d}"
+        with medidor.medir('agregar_cliente'):
+            restaurante.agregar_cliente(f"Cliente {i}", cedula, cedula)
+        with medidor.medir('asignar_mesa'):
+            restaurante.asignar_mesa(cedula, 1 + i % 5)
+        with medidor.medir('anotar_pedido'):
+            restaurante.anotar_pedido(cedula, False, f"Plato {i % platos}", 1 + i % 3, "Ninguna")
+        with medidor.medir('atender_pedido'):
+            restaurante.atender_pedido(cedula)
+        cliente = restaurante.comprobar_cliente(cedula)
+        pedido = Pedido.objects.filter(cliente=cliente).first()
+        if cliente is not None and cliente.mesa is not None and pedido is not None:
+            with medidor.medir('mostrar_cuenta'):
+                restaurante.mostrar_cuenta(cliente, pedido)
+
+
+def ejecutar(args) -> dict:
+    configurar_django(args.base[0], [*args.apps, args.app])
+    from django.apps import apps
+
+    # Los eventos se descartan para medir solo el trabajo de base de datos.
+    sys.modules[apps.get_app_config(args.app).models_module.__name__].sumidero_eventos.consumidores = []
+    medidor = Medidor()
+    restaurante = construir_restaurante(args.app, args.mesas, args.meseros, args.cocineros, args.platos)
+    inicio = time.perf_counter()
+    hora_pico(args.app, restaurante, args.clientes, args.platos, medidor)
+    return {
+        'base': args.base[0],
+        'parametros': {'mesas': args.mesas, 'meseros': args.meseros, 'cocineros': args.cocineros,
+                       'platos': args.platos, 'clientes': args.clientes},
+        'tiempo_total_s': time.perf_counter() - inicio,
+        'operaciones': medidor.resumen(),
+    }
+
+
+def ejecutar_en_subproceso(args, base: str) -> dict:
+    # settings.configure solo puede llamarse una vez por proceso: cada base corre en su propio proceso.
+    comando = [sys.executable, os.path.abspath(__file__), '--app', args.app, '--apps', *args.apps,
+               '--base', base, '--mesas', str(args.mesas), '--meseros', str(args.meseros),
+               '--cocineros', str(args.cocineros), '--platos', str(args.platos),
+               '--clientes', str(args.clientes), '--salida', '-', '--sin-presupuesto']
+    salida = subprocess.run(comando, check=True, capture_output=True, text=True).stdout
+    return json.loads(salida)[0]
+
+
+def excesos_de_presupuesto(resultados: list, presupuesto: dict) -> list:
+    excesos = []
+    for resultado in resultados:
+        for operacion, datos in resultado['operaciones'].items():
+            limite = presupuesto.get(operacion)
+            if limite is not None and datos['consultas_p95'] > limite:
+                excesos.append(f"[{resultado['base']}] {operacion}: {datos['consultas_p95']} consultas p95 (presupuesto {limite})")
+    return excesos
+
+
+def comparar(resultados: list, ruta_anterior: str):
+    with open(ruta_anterior, encoding='utf-8') as archivo:
+        anteriores = {resultado['base']: resultado for resultado in json.load(archivo)}
+    for resultado in resultados:
+        anterior = anteriores.get(resultado['base'])
+        if anterior is None:
+            continue
+        for operacion, datos in resultado['operaciones'].items():
+            previo = anterior['operaciones'].get(operacion)
+            if previo is not None:
+                print(f"[{resultado['base']}] {operacion}: "
+                      f"{previo['tiempo_medio_ms']:.2f} -> {datos['tiempo_medio_ms']:.2f} ms | "
+                      f"{previo.get('consultas_p95', previo['consultas_max'])} -> {datos['consultas_p95']} consultas p95",
+                      file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de hora pico del flujo de Restaurante")
+    parser.add_argument('--app', required=True, help="Etiqueta de la app que contiene los modelos del restaurante")
+    parser.add_argument('--apps', nargs='*', default=['inventario'], help="Apps adicionales requeridas por los modelos")
+    parser.add_argument('--base', nargs='+', choices=['memoria', 'archivo'], default=['memoria', 'archivo'])
+    parser.add_argument('--mesas', type=int, default=50)
+    parser.add_argument('--meseros', type=int, default=10)
+    parser.add_argument('--cocineros', type=int, default=5)
+    parser.add_argument('--platos', type=int, default=40)
+    parser.add_argument('--clientes', type=int, default=200)
+    parser.add_argument('--salida', default='benchmark.json', help="Archivo JSON de resultados ('-' para stdout)")
+    parser.add_argument('--comparar', help="Resultados anteriores con los que comparar")
+    parser.add_argument('--presupuesto', nargs='*', default=[], metavar='OPERACION=CONSULTAS')
+    parser.add_argument('--sin-presupuesto', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if len(args.base) == 1 and args.sin_presupuesto:
+        resultados = [ejecutar(args)]
+    else:
+        resultados = [ejecutar_en_subproceso(args, base) for base in args.base]
+
+    contenido = json.dumps(resultados, indent=2)
+    if args.salida == '-':
+        print(contenido)
+    else:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(contenido)
+    if args.comparar:
+        comparar(resultados, args.comparar)
+    if args.sin_presupuesto:
+        return 0
+
+    presupuesto = dict(PRESUPUESTO_CONSULTAS)
+    for valor in args.presupuesto:
+        operacion, limite = valor.split('=')
+        presupuesto[operacion] = int(limite)
+    excesos = excesos_de_presupuesto(resultados, presupuesto)
+    for exceso in excesos:
+        print(f"¡Presupuesto de consultas superado! {exceso}", file=sys.stderr)
+    return 1 if excesos else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
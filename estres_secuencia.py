@@ -0,0 +1,119 @@
+#Prueba de estres de Secuencia con varios procesos escribiendo a la vez.
+#Crea una base SQLite en archivo, lanza --procesos procesos que crean pedidos y mesas del mismo restaurante
+#al mismo tiempo y comprueba que los numeros no se repiten y que no quedan huecos (salvo el resto sin usar
+#del ultimo bloque de pedidos de cada proceso).
+#Uso:
+#    python estres_secuencia.py --app restaurante --procesos 4 --pedidos 500 --mesas 20
+#Termina con codigo 1 si hay colisiones o huecos.
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+
+BLOQUE_PEDIDOS = 20
+
+
+def configurar_django(ruta: str, apps: list):
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ruta, 'OPTIONS': {'timeout': 60}}},
+        INSTALLED_APPS=['django.contrib.contenttypes', *apps],
+        DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+        USE_TZ=True,
+    )
+    django.setup()
+
+
+def preparar(args) -> int:
+    from django.apps import apps
+    from django.core.management import call_command
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    Restaurante = apps.get_model(args.app, 'Restaurante')
+    restaurante = Restaurante(nombre="Estres")
+    restaurante.save()
+    return restaurante.pk
+
+
+def trabajar(args):
+    from django.apps import apps
+
+    sys.modules[apps.get_app_config(args.app).models_module.__name__].sumidero_eventos.consumidores = []
+    Cliente = apps.get_model(args.app, 'Cliente')
+    Pedido = apps.get_model(args.app, 'Pedido')
+    Restaurante = apps.get_model(args.app, 'Restaurante')
+    restaurante = Restaurante.objects.get(pk=args.restaurante)
+    for i in range(args.pedidos):
+        cedula = f"{args.trabajador:02d}{i:08d}"
+        cliente = Cliente(nombre=f"Cliente {cedula}", cedula=cedula, telefono=cedula, restaurante=restaurante)
+        cliente.save()
+        Pedido(cliente=cliente, restaurante=restaurante).save()
+    for i in range(args.mesas):
+        restaurante.agregar_mesa(2 + i % 5)
+
+
+def comprobar(args) -> dict:
+    from django.apps import apps
+
+    resultado = {}
+    esperados = {
+        'pedidos': (apps.get_model(args.app, 'Pedido'), args.pedidos, BLOQUE_PEDIDOS),
+        'mesas': (apps.get_model(args.app, 'Mesa'), args.mesas, 1),
+    }
+    for nombre, (modelo, por_proceso, bloque) in esperados.items():
+        numeros = list(modelo.objects.filter(restaurante_id=args.restaurante).values_list('numero', flat=True))
+        repetidos = sorted(numero for numero, veces in Counter(numeros).items() if veces > 1)
+        huecos = sorted(set(range(1, max(numeros, default=0) + 1)) - set(numeros))
+        # Cada proceso puede dejar sin usar el resto de su ultimo bloque, que no esta necesariamente al final.
+        sin_usar = args.procesos * (math.ceil(por_proceso / bloque) * bloque - por_proceso)
+        resultado[nombre] = {'filas': len(numeros), 'esperadas': args.procesos * por_proceso,
+                             'repetidos': repetidos, 'huecos': len(huecos), 'huecos_permitidos': sin_usar}
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de estres de la asignacion de numeros de Secuencia")
+    parser.add_argument('--app', required=True, help="Etiqueta de la app que contiene los modelos del restaurante")
+    parser.add_argument('--apps', nargs='*', default=['inventario'], help="Apps adicionales requeridas por los modelos")
+    parser.add_argument('--procesos', type=int, default=4)
+    parser.add_argument('--pedidos', type=int, default=500, help="Pedidos por proceso")
+    parser.add_argument('--mesas', type=int, default=20, help="Mesas por proceso")
+    parser.add_argument('--base', help=argparse.SUPPRESS)
+    parser.add_argument('--restaurante', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--trabajador', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.trabajador is not None:
+        configurar_django(args.base, [*args.apps, args.app])
+        trabajar(args)
+        return 0
+
+    args.base = os.path.join(tempfile.mkdtemp(), 'estres.sqlite3')
+    configurar_django(args.base, [*args.apps, args.app])
+    args.restaurante = preparar(args)
+    # settings.configure solo puede llamarse una vez por proceso: cada trabajador es un proceso aparte.
+    trabajadores = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--app', args.app, '--apps', *args.apps,
+                                      '--pedidos', str(args.pedidos), '--mesas', str(args.mesas), '--base', args.base,
+                                      '--restaurante', str(args.restaurante), '--trabajador', str(trabajador)])
+                    for trabajador in range(args.procesos)]
+    if any(trabajador.wait() for trabajador in trabajadores):
+        print("¡Algun proceso termino con error!", file=sys.stderr)
+        return 1
+
+    resultado = comprobar(args)
+    print(json.dumps(resultado, indent=2))
+    fallos = [nombre for nombre, datos in resultado.items()
+              if datos['repetidos'] or datos['filas'] != datos['esperadas'] or datos['huecos'] > datos['huecos_permitidos']]
+    for nombre in fallos:
+        print(f"¡Numeracion de {nombre} incorrecta!", file=sys.stderr)
+    return 1 if fallos else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
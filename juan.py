@@ -1,8 +1,44 @@
+import asyncio
+import atexit
+import bisect
+import contextlib
+import contextvars
+import csv
+import functools
+import hashlib
+import heapq
+import inspect
+import itertools
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import unicodedata
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from decimal import Decimal
 from enum import Enum
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from inventario.models import Insumo
 
+#Campo de Insumo con la existencia que se descuenta al vender:
+CAMPO_EXISTENCIA_INSUMO = 'cantidad'
+
 #Enumerador:
 class Estado(Enum):
     en_preparacion = 'EN PREPARACION'
@@ -12,8 +48,409 @@ class Estado(Enum):
     servido = 'SERVIDO'
     reservado = 'RESERVADO'
 
+#Eventos:
+@dataclass(frozen=True)
+class Evento:
+    def mensaje(self) -> str:
+        raise NotImplementedError("Este método debe ser implementado por una subclase")
+
+    def como_dict(self) -> dict:
+        return {'tipo': type(self).__name__, **asdict(self)}
+
+@dataclass(frozen=True)
+class PedidoRealizado(Evento):
+    cliente: str
+    plato: str
+    cantidad: int
+    observacion: str
+    def mensaje(self):
+        if self.observacion.lower() == "ninguna":
+            return f"-> {self.cliente} pidió [{self.cantidad}] ({self.plato})"
+        return f"-> {self.cliente} pidió [{self.cantidad}] ({self.plato}) {{{self.observacion}}}"
+
+@dataclass(frozen=True)
+class TiempoEsperaInformado(Evento):
+    pedido: int
+    plato: str
+    minutos: int
+    def mensaje(self):
+        return f"-> El plato de ({self.plato}) estará en {self.minutos} minutos"
+
+@dataclass(frozen=True)
+class PedidoRegistrado(Evento):
+    pedido: int
+    def mensaje(self):
+        return f"{{ Pedido {self.pedido} guardado en el Registro del restaurante }}"
+
+@dataclass(frozen=True)
+class PedidoGestionado(Evento):
+    pedido: int
+    cliente: str
+    def mensaje(self):
+        return f"--> El pedido ({self.pedido}) del cliente {self.cliente} ahora está en proceso"
+
+@dataclass(frozen=True)
+class PedidoEntregado(Evento):
+    pedido: int
+    cliente: str
+    def mensaje(self):
+        return f"--> El pedido {self.pedido} fue entregado al cliente {self.cliente}"
+
+@dataclass(frozen=True)
+class EntregaNoRealizada(Evento):
+    pedido: int
+    mesero: str
+    def mensaje(self):
+        return f"¡El pedido {self.pedido} cambió de estado antes de que {self.mesero} lo entregara!"
+
+@dataclass(frozen=True)
+class PreparacionNoTerminada(Evento):
+    pedido: int
+    cocinero: str
+    def mensaje(self):
+        return f"¡El pedido {self.pedido} cambió de estado antes de que {self.cocinero} terminara de prepararlo!"
+
+@dataclass(frozen=True)
+class EntregaGestionada(Evento):
+    pedido: int
+    mesero: str
+    def mensaje(self):
+        return f"--> El pedido {self.pedido} fue gestionado y entregado por {self.mesero}"
+
+@dataclass(frozen=True)
+class PagoRealizado(Evento):
+    pedido: int
+    cliente: str
+    total: Decimal
+    def mensaje(self):
+        return f"--> {self.cliente} realizó el pago de ${self.total}"
+
+@dataclass(frozen=True)
+class CobroRechazado(Evento):
+    pedido: int
+    cliente: str
+    estado: str
+    def mensaje(self):
+        if self.estado == Estado.pagado.name:
+            return f"¡El pedido {self.pedido} de {self.cliente} ya fue cobrado!"
+        return f"¡El pedido {self.pedido} de {self.cliente} aún no se puede cobrar (estado: {self.estado})!"
+
+@dataclass(frozen=True)
+class PedidoAgregadoHistorial(Evento):
+    pedido: int
+    def mensaje(self):
+        return f"--> Pedido {self.pedido} agregado al historial del cliente."
+
+@dataclass(frozen=True)
+class MesaDesocupada(Evento):
+    cliente: str
+    mesa: int
+    def mensaje(self):
+        return f"--> {self.cliente} ha desocupado la mesa {self.mesa}"
+
+@dataclass(frozen=True)
+class GrupoEnEspera(Evento):
+    cliente: str
+    personas: int
+    def mensaje(self):
+        return f"--> {self.cliente} quedó en la lista de espera para {self.personas} personas"
+
+@dataclass(frozen=True)
+class TransferenciaAvanzada(Evento):
+    operacion: str
+    entidad: str
+    filas: int
+    def mensaje(self):
+        return f"--> {self.operacion} de {self.entidad}: {self.filas} filas"
+
+@dataclass(frozen=True)
+class FilasOmitidas(Evento):
+    entidad: str
+    filas: int
+    def mensaje(self):
+        return f"¡Importacion de {self.entidad}: {self.filas} filas omitidas por cédula o teléfono repetidos!"
+
+@dataclass(frozen=True)
+class ClienteNoEncontrado(Evento):
+    cedula: str
+    def mensaje(self):
+        return "¡El cliente ingresado no existe dentro de la lista de clientes!"
+
+@dataclass(frozen=True)
+class ClienteDuplicado(Evento):
+    nombre: str
+    existente: str
+    def mensaje(self):
+        return f"¡No se pudo agregar al cliente {self.nombre} debido a que la cédula ya pertenece al cliente {self.existente}!"
+
+@dataclass(frozen=True)
+class MesaAsignada(Evento):
+    cliente: str
+    mesa: int
+    capacidad: int
+    def mensaje(self):
+        return f"---> A {self.cliente} se le asignó la mesa (Número: {self.mesa} | Capacidad: {self.capacidad} personas)"
+
+@dataclass(frozen=True)
+class MesaYaAsignada(Evento):
+    cliente: str
+    mesa: int
+    def mensaje(self):
+        return f"¡El cliente ya tiene reservada la mesa {self.mesa}!"
+
+@dataclass(frozen=True)
+class SinMesaDisponible(Evento):
+    cliente: str
+    def mensaje(self):
+        return f"¡No hay mesas disponibles por el momento para el cliente {self.cliente}!"
+
+@dataclass(frozen=True)
+class MesaNoCompartible(Evento):
+    cliente: str
+    mesa: int
+    def mensaje(self):
+        return f"¡La mesa {self.mesa} no está ocupada por ningún grupo!"
+
+@dataclass(frozen=True)
+class MesaReservada(Evento):
+    cliente: str
+    mesa: int
+    def mensaje(self):
+        return f"{{ La mesa {self.mesa} está ahora reservada para {self.cliente} }}"
+
+@dataclass(frozen=True)
+class ReservaNoDisponible(Evento):
+    cliente: str
+    mesa: int
+    def mensaje(self):
+        return f"La mesa {self.mesa} no está disponible por el momento"
+
+@dataclass(frozen=True)
+class PlatoNoEncontrado(Evento):
+    plato: str
+    def mensaje(self):
+        return f"¡No se encontró ({self.plato}) dentro del menú!"
+
+@dataclass(frozen=True)
+class OrdenRechazada(Evento):
+    cliente: str
+    def mensaje(self):
+        return f"¡No se puede tomar la orden a {self.cliente} ya que no tiene mesa asignada!"
+
+@dataclass(frozen=True)
+class ItemModificado(Evento):
+    cliente: str
+    plato: str
+    agregado: bool
+    def mensaje(self):
+        return "El item fue agregado al pedido" if self.agregado else "El pedido no posee dicho item"
+
+@dataclass(frozen=True)
+class AtencionIniciada(Evento):
+    cliente: str
+    def mensaje(self):
+        return f"---> Atendiendo a {self.cliente} <---"
+
+@dataclass(frozen=True)
+class AtencionRechazada(Evento):
+    cliente: str
+    motivo: str
+    def mensaje(self):
+        return f"¡No se puede atender a {self.cliente} ya que {self.motivo}!"
+
+@dataclass(frozen=True)
+class SinPersonalCocina(Evento):
+    restaurante: str
+    def mensaje(self):
+        return "¡No hay personal de cocina disponible por el momento!"
+
+@dataclass(frozen=True)
+class CuentaPresentada(Evento):
+    pedido: int
+    cliente: str
+    total: Decimal
+    def mensaje(self):
+        return f"--> Total a pagar: ${self.total}"
+
+@dataclass(frozen=True)
+class ListadoMostrado(Evento):
+    # Menu, mesas disponibles e historiales: pasan por el sumidero para salir en orden con el resto.
+    titulo: str
+    lineas: tuple
+    def mensaje(self):
+        return '\n'.join(self.lineas)
+
+class ConsumidorConsola:
+    def __call__(self, evento: Evento):
+        print(evento.mensaje())
+
+class ConsumidorJSONL:
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+    def __call__(self, evento: Evento):
+        with open(self.ruta, 'a', encoding='utf-8') as archivo:
+            archivo.write(json.dumps(evento.como_dict(), default=str, ensure_ascii=False) + '\n')
+
+class ConsumidorMemoria:
+    def __init__(self):
+        self.eventos = []
+    def __call__(self, evento: Evento):
+        self.eventos.append(evento)
+
+class SumideroEventos:
+    # emitir() solo encola y un hilo en segundo plano entrega los eventos en orden, asi escribir a consola o
+    # a archivo no bloquea la peticion. Un consumidor con sincrono = True los recibe en el momento.
+    def __init__(self, *consumidores):
+        self.consumidores = list(consumidores)
+        self._candado = threading.Lock()
+        self._pid = None
+
+    def emitir(self, evento: Evento):
+        asincronos = False
+        for consumidor in list(self.consumidores):
+            if getattr(consumidor, 'sincrono', False):
+                self._entregar(consumidor, evento)
+            else:
+                asincronos = True
+        if not asincronos:
+            return
+        if self._pid != os.getpid():
+            self._iniciar()
+        self._cola.put_nowait(evento)
+
+    def vaciar(self):
+        if self._pid == os.getpid():
+            self._cola.join()
+
+    def _iniciar(self):
+        with self._candado:
+            if self._pid != os.getpid():
+                self._cola = queue.Queue()
+                threading.Thread(target=self._despachar, name='sumidero-eventos', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _despachar(self):
+        while True:
+            evento = self._cola.get()
+            for consumidor in list(self.consumidores):
+                if not getattr(consumidor, 'sincrono', False):
+                    self._entregar(consumidor, evento)
+            self._cola.task_done()
+
+    @staticmethod
+    def _entregar(consumidor, evento: Evento):
+        try:
+            consumidor(evento)
+        except Exception:
+            logging.getLogger(__name__).exception("Error al entregar el evento %s", type(evento).__name__)
+
+sumidero_eventos = SumideroEventos(ConsumidorConsola())
+atexit.register(sumidero_eventos.vaciar)
+
+def emitir(evento: Evento):
+    sumidero_eventos.emitir(evento)
+
+#Metricas:
+class Histograma:
+    __slots__ = ('limites', 'cuentas', 'suma', 'total')
+    def __init__(self, limites):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)
+        self.suma = 0
+        self.total = 0
+    def observar(self, valor):
+        self.cuentas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+class RegistroMetricas:
+    # Histogramas acumulados en memoria por operacion; se exportan en formato de texto de Prometheus.
+    LIMITES = {
+        'restaurante_operacion_segundos': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+        'restaurante_operacion_consultas': (1, 2, 5, 10, 20, 50, 100, 200),
+        'restaurante_operacion_filas': (0, 1, 5, 10, 50, 100, 500, 1000),
+    }
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._histogramas = {}
+        self._llamadas = defaultdict(int)
+
+    def registrar(self, operacion: str, duracion: float, consultas: int, filas: int, resultado: str):
+        with self._candado:
+            for metrica, valor in zip(self.LIMITES, (duracion, consultas, filas)):
+                clave = (metrica, operacion)
+                if clave not in self._histogramas:
+                    self._histogramas[clave] = Histograma(self.LIMITES[metrica])
+                self._histogramas[clave].observar(valor)
+            self._llamadas[(operacion, resultado)] += 1
+
+    def prometheus(self) -> str:
+        lineas = []
+        with self._candado:
+            for metrica in self.LIMITES:
+                lineas.append(f"# TYPE {metrica} histogram")
+                for (nombre, operacion), histograma in sorted(self._histogramas.items()):
+                    if nombre != metrica:
+                        continue
+                    acumulado = 0
+                    for limite, cuenta in zip((*histograma.limites, '+Inf'), histograma.cuentas):
+                        acumulado += cuenta
+                        lineas.append(f'{metrica}_bucket{{operacion="{operacion}",le="{limite}"}} {acumulado}')
+                    lineas.append(f'{metrica}_sum{{operacion="{operacion}"}} {histograma.suma}')
+                    lineas.append(f'{metrica}_count{{operacion="{operacion}"}} {histograma.total}')
+            lineas.append("# TYPE restaurante_operacion_total counter")
+            for (operacion, resultado), cuenta in sorted(self._llamadas.items()):
+                lineas.append(f'restaurante_operacion_total{{operacion="{operacion}",resultado="{resultado}"}} {cuenta}')
+        return '\n'.join(lineas) + '\n'
+
+    def volcar(self, ruta: str):
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            archivo.write(self.prometheus())
+
+metricas = RegistroMetricas()
+
+class ContadorConsultas:
+    def __init__(self):
+        self.consultas = 0
+        self.filas = 0
+    def __call__(self, execute, sql, params, many, context):
+        resultado = execute(sql, params, many, context)
+        self.consultas += 1
+        self.filas += max(context['cursor'].rowcount, 0)
+        return resultado
+
+def instrumentar(operacion: str, metodo):
+    @functools.wraps(metodo)
+    def envoltura(*args, **kwargs):
+        contador = ContadorConsultas()
+        resultado = 'error'
+        inicio = time.perf_counter()
+        try:
+            # Se cuentan las consultas de todas las bases configuradas: los routers pueden mandar la operacion
+            # a la base de un local o a la replica.
+            with contextlib.ExitStack() as envolturas:
+                for conexion in connections.all():
+                    envolturas.enter_context(conexion.execute_wrapper(contador))
+                valor = metodo(*args, **kwargs)
+            resultado = 'ok'
+            return valor
+        finally:
+            metricas.registrar(operacion, time.perf_counter() - inicio, contador.consultas, contador.filas, resultado)
+    return envoltura
+
+class InterfazInstrumentada:
+    # Toda clase que implemente un metodo declarado por una interfaz queda medida automaticamente.
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for interfaz in cls.__mro__[1:]:
+            if InterfazInstrumentada not in interfaz.__bases__:
+                continue
+            for nombre, declarado in vars(interfaz).items():
+                if inspect.isfunction(declarado) and inspect.isfunction(vars(cls).get(nombre)):
+                    setattr(cls, nombre, instrumentar(f"{cls.__name__}.{nombre}", vars(cls)[nombre]))
+
 #Interfaz:
-class InteraccionPedido(models.Model):
+class InteraccionPedido(InterfazInstrumentada, models.Model):
     class Meta:
         abstract = True
     #Metodos:
@@ -22,7 +459,7 @@ class InteraccionPedido(models.Model):
     def visualizar_estado(self, pedido:'Pedido'):
         pass
 
-class InteraccionCliente(models.Model):
+class InteraccionCliente(InterfazInstrumentada, models.Model):
 
     def agregar_cliente(self, nombre: str, cedula: str, telefono: str):
         raise NotImplementedError("Este método debe ser implementado por una subclase")
@@ -51,23 +488,24 @@ class InteraccionCliente(models.Model):
 #Clases:
 class Persona(models.Model):
     #Atributos:
-    cedula = models.CharField(max_length=10, unique=True)
+    cedula = models.CharField(max_length=10, db_index=True)
     nombre = models.CharField(max_length=50)
-    telefono = models.CharField(max_length=10, unique=True)
+    telefono = models.CharField(max_length=10)
     class Meta:
         abstract = True
 
 class Empleado(Persona, InteraccionPedido):
     #Atributos:
+    cedula = models.CharField(max_length=10, unique=True)
+    telefono = models.CharField(max_length=10, unique=True)
     identificacion = models.CharField(max_length=7, unique=True, null=True, editable=False)
     #Asociacion:
     pedidos = models.ManyToManyField('Pedido', blank=True, editable=False)
     class Meta:
         abstract = True
     #Metodos:
-    def actualizar_estado(self, estado:Estado, pedido:'Pedido'):
-        pedido.estado = estado
-        pedido.save()
+    def actualizar_estado(self, estado:Estado, pedido:'Pedido') -> bool:
+        return pedido.transicionar(estado)
     def visualizar_estado(self, pedido:'Pedido'):
         return pedido.estado
 
@@ -81,12 +519,16 @@ class Mesero(Empleado):
     def save(self, *args, **kwargs):
         if not self.identificacion:
             letra_nombre = self.nombre[0].upper()
-            empleados = Mesero.objects.filter(identificacion__startswith=f"11M").count() + 1
+            empleados = Secuencia.siguiente('mesero', lambda: Mesero.objects.filter(identificacion__startswith=f"11M").count())
             self.identificacion = f"11M{letra_nombre}{empleados:02d}"
         super().save(*args, **kwargs)
     def entregar_pedido(self, pedido):
-        self.actualizar_estado(Estado.servido, pedido)
-        print(f"--> El pedido {pedido.numero} fue entregado al cliente {pedido.cliente.nombre}")
+        if not self.actualizar_estado(Estado.servido, pedido):
+            emitir(EntregaNoRealizada(pedido.numero, self.nombre))
+            return False
+        self.pedidos.add(pedido)
+        emitir(PedidoEntregado(pedido.numero, pedido.cliente.nombre))
+        return True
     def __str__(self):
         return self.nombre+' | '+self.identificacion
 class PersonalCocina(Empleado):
@@ -99,24 +541,33 @@ class PersonalCocina(Empleado):
     def save(self, *args, **kwargs):
         if not self.identificacion:
             letra_nombre = self.nombre[0].upper()
-            empleados = PersonalCocina.objects.filter(identificacion__startswith=f"11P").count() + 1
+            empleados = Secuencia.siguiente('personal_cocina',
+                                            lambda: PersonalCocina.objects.filter(identificacion__startswith=f"11P").count())
             self.identificacion = f"11P{letra_nombre}{empleados:02d}"
         super().save(*args, **kwargs)
 
-    def preparar_pedido(self, pedido):
+    def preparar_pedido(self, pedido, demora=0):
+        # demora: minutos que faltan para que este cocinero termine lo que ya tiene en cola.
+        # Devuelve None si otro cocinero tomo el pedido primero.
+        if not self.actualizar_estado(Estado.en_preparacion, pedido):
+            return None
         self.esta_cocinando = True
-        self.actualizar_estado(Estado.en_preparacion, pedido)
+        self.save(update_fields=['esta_cocinando'])
         self.pedidos.add(pedido)
-        for item_pedido in pedido.item_pedido_list.all():
-            if item_pedido.plato.nombre.lower() == "pizza":
-                tiempo_espera = 5
-                pedido.mostrar_tiempo_espera(tiempo_espera, item_pedido)
-            elif item_pedido.plato.nombre.lower() == "ensalada":
-                tiempo_espera = 7
-                pedido.mostrar_tiempo_espera(tiempo_espera, item_pedido)
-            else:
-                tiempo_espera = 10
-                pedido.mostrar_tiempo_espera(tiempo_espera, item_pedido)
+        tiempo_espera = demora
+        for item_pedido in pedido.item_pedido_list.select_related('plato'):
+            tiempo_espera += item_pedido.cantidad * item_pedido.plato.tiempo_preparacion
+            pedido.mostrar_tiempo_espera(tiempo_espera, item_pedido)
+        return tiempo_espera
+
+    def terminar_pedido(self, pedido):
+        # Si otro proceso cambio el estado del pedido antes, el cocinero sigue ocupado.
+        if not self.actualizar_estado(Estado.preparado, pedido):
+            emitir(PreparacionNoTerminada(pedido.numero, self.nombre))
+            return False
+        self.esta_cocinando = False
+        self.save(update_fields=['esta_cocinando'])
+        return True
     def __str__(self):
         return self.nombre+' | '+self.identificacion
 
@@ -129,11 +580,15 @@ class Cliente(Persona):
     # Asociación:
     historial = models.OneToOneField('Historial', on_delete=models.CASCADE, null=True, editable=False,
                                      related_name='cliente')
-    mesa = models.OneToOneField('Mesa', on_delete=models.CASCADE, null=True, editable=False)
+    mesa = models.ForeignKey('Mesa', on_delete=models.SET_NULL, null=True, editable=False, related_name='clientes')
+    restaurante = models.ForeignKey('Restaurante', on_delete=models.CASCADE, null=True, editable=False,
+                                    related_name='clientes')
 
     class Meta:
         verbose_name = "Cliente"
         verbose_name_plural = "Clientes"
+        constraints = [models.UniqueConstraint(fields=['restaurante', 'cedula'], name='cliente_restaurante_cedula'),
+                       models.UniqueConstraint(fields=['restaurante', 'telefono'], name='cliente_restaurante_telefono')]
 
     # Métodos:
     def save(self, *args, **kwargs):
@@ -150,29 +605,52 @@ class Cliente(Persona):
             if item_pedido in self.item_pedido_list.all():
                 self.item_pedido_list.remove(item_pedido)
             else:
-                print("El pedido no posee dicho item")
+                emitir(ItemModificado(self.nombre, item_pedido.plato.nombre, False))
         else:
             self.item_pedido_list.add(item_pedido)
-            print("El item fue agregado al pedido")
+            emitir(ItemModificado(self.nombre, item_pedido.plato.nombre, True))
 
     def ocupar_mesa(self, mesa_ocupada):
         self.mesa = mesa_ocupada
         self.save()
 
     def realizar_pago(self, total, pedido):
-        print(f"--> {self.nombre} realizó el pago de ${total}")
-        if self.mesa:
-            self.historial.agregar_pedido(pedido, self.mesa.numero)
-        else:
-            self.historial.agregar_pedido(pedido, 0)
-
-        if not self.es_para_llevar:
-            self.mesa.desocupar()
-            print(f"--> {self.nombre} ha desocupado la mesa {self.mesa.numero}")
-            self.mesa = None
-            self.save()
-
-        self.item_pedido_list.clear()
+        # Todo el cobro es una transaccion: el paso a pagado guarda tambien la informacion del historial en el
+        # mismo UPDATE y el resto son escrituras directas (vinculo del historial, items, mesa del cliente, mesa).
+        # Devuelve False (y emite CobroRechazado) si el pedido aun no se sirvio, ya se cobro o cambio de estado.
+        if not pedido.puede_pasar_a(Estado.pagado):
+            emitir(CobroRechazado(pedido.numero, self.nombre, pedido.estado))
+            return False
+        mesa = self.mesa
+        pedido.cliente = self
+        pedido.registrar_informacion(mesa.numero if mesa else 0)
+        alias = alias_de_escritura(Pedido, pedido)
+        liberada = False
+
+        def informar():
+            emitir(PagoRealizado(pedido.numero, self.nombre, total))
+            emitir(PedidoAgregadoHistorial(pedido.numero))
+            if liberada:
+                emitir(MesaDesocupada(self.nombre, mesa.numero))
+
+        with transaction.atomic(using=alias):
+            if not pedido.transicionar(Estado.pagado, informacion=pedido.informacion):
+                emitir(CobroRechazado(pedido.numero, self.nombre, Pedido.objects.values_list('estado', flat=True).get(pk=pedido.pk)))
+                return False
+            # Se registra antes que el aviso de desocupar(), que sienta al siguiente grupo de la lista de espera.
+            transaction.on_commit(informar, using=alias)
+            Historial.pedidos.through.objects.create(historial_id=self.historial_id, pedido_id=pedido.pk)
+            registrar_venta(pedido, mesa)
+            ItemPedido.objects.filter(cliente=self, pedido=pedido).update(cliente=None)
+            # El cliente deja la mesa con su ultimo ticket abierto; en una mesa compartida la mesa se libera
+            # cuando ya no queda nadie sentado.
+            if (not self.es_para_llevar and mesa is not None and
+                    not Pedido.objects.abiertos().filter(cliente=self).exclude(pk=pedido.pk).exists()):
+                Cliente.objects.filter(pk=self.pk).update(mesa=None)
+                self.mesa = None
+                if not mesa.clientes.exists():
+                    liberada = mesa.desocupar()
+        return True
 
     def realizar_pedido(self, es_para_llevar, plato, cantidad, observacion):
         self.es_para_llevar = es_para_llevar
@@ -181,18 +659,26 @@ class Cliente(Persona):
         item_pedido.save()
         self.item_pedido_list.add(item_pedido)
 
-        if observacion.lower() == "ninguna":
-            print(f"-> {self.nombre} pidió [{cantidad}] ({plato.nombre})")
-        else:
-            print(f"-> {self.nombre} pidió [{cantidad}] ({plato.nombre}) {{{observacion}}}")
+        emitir(PedidoRealizado(self.nombre, plato.nombre, cantidad, observacion))
 
         self.realizo_pedido = True
         self.save()
 
+    def realizar_pedidos(self, es_para_llevar, lineas):
+        # lineas: tuplas (plato, cantidad, observacion) ya validadas contra el menu.
+        with transaction.atomic(using=alias_de_escritura(Cliente, self)):
+            ItemPedido.objects.bulk_create([ItemPedido(cliente=self, plato=plato, cantidad=cantidad, observacion=observacion,
+                                                       precio_unitario=plato.precio)
+                                            for plato, cantidad, observacion in lineas])
+            Cliente.objects.filter(pk=self.pk).update(es_para_llevar=es_para_llevar, realizo_pedido=True)
+        self.es_para_llevar = es_para_llevar
+        self.realizo_pedido = True
+        for plato, cantidad, observacion in lineas:
+            emitir(PedidoRealizado(self.nombre, plato.nombre, cantidad, observacion))
+
     def visualizar_mesa_asignada(self):
         if self.mesa:
-            print(
-                f"---> A {self.nombre} se le asignó la mesa (Número: {self.mesa.numero} | Capacidad: {self.mesa.capacidad} personas)")
+            emitir(MesaAsignada(self.nombre, self.mesa.numero, self.mesa.capacidad))
 
     def __str__(self):
         return self.nombre + ' | ' + self.cedula
@@ -201,57 +687,193 @@ class ItemPedido(models.Model):
     #Atributos:
     cantidad = models.PositiveIntegerField(default=1)
     observacion = models.CharField(max_length=100 ,blank=True, default='Ninguna')
+    # Precio del plato al momento de pedir: totales y resumenes de ventas no cambian si luego cambia el precio.
+    precio_unitario = models.DecimalField(max_digits=5, decimal_places=2, editable=False)
     #Asociacion:
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='item_pedido_list', null=True)
-    plato = models.OneToOneField('Plato', on_delete=models.CASCADE)
+    plato = models.ForeignKey('Plato', on_delete=models.CASCADE)
     class Meta:
         verbose_name = "Item del Pedido"
         verbose_name_plural = "Items del Pedido"
     # Metodos:
+    def save(self, *args, **kwargs):
+        if self.precio_unitario is None:
+            self.precio_unitario = self.plato.precio
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.plato.nombre+' | '+str(self.cantidad)+' | '+self.cliente.nombre+' | '+self.observacion
 
+class PedidoQuerySet(models.QuerySet):
+    # Pedidos abiertos: los pagados salen del conjunto activo y del indice parcial de Pedido.
+    def abiertos(self):
+        return self.exclude(estado=Estado.pagado.name)
+
+    def abiertos_de(self, cliente: 'Cliente', estado: str):
+        return self.abiertos().filter(cliente=cliente, estado=estado)
+
+    def para_reporte(self):
+        # Fija la base al crear el queryset: los generadores de historial se evaluan fuera de en_reporte().
+        return self.using(alias_de_reporte())
+
+    # Historial: filas estructuradas paginadas por clave (WHERE numero > ultimo ORDER BY numero LIMIT n),
+    # asi la pagina N cuesta lo mismo que la primera y nunca se materializa la relacion completa.
+    CAMPOS_HISTORIAL = ('numero', 'fecha_creacion', 'fecha_actual', 'estado', 'total', 'informacion')
+
+    def filtrar(self, desde=None, hasta=None, estados=None):
+        pedidos = self
+        if desde is not None:
+            pedidos = pedidos.filter(fecha_creacion__gte=desde)
+        if hasta is not None:
+            pedidos = pedidos.filter(fecha_creacion__lt=hasta)
+        if estados:
+            pedidos = pedidos.filter(estado__in=[estado.name if isinstance(estado, Estado) else estado for estado in estados])
+        return pedidos
+
+    def pagina(self, despues_de=None, tamano=100) -> list:
+        pedidos = self.order_by('numero')
+        if despues_de is not None:
+            pedidos = pedidos.filter(numero__gt=despues_de)
+        return list(pedidos.values(*self.CAMPOS_HISTORIAL)[:tamano])
+
+    def iterar(self, tamano=100):
+        despues_de = None
+        while True:
+            filas = self.pagina(despues_de, tamano)
+            yield from filas
+            if len(filas) < tamano:
+                return
+            despues_de = filas[-1]['numero']
+
 class Pedido(models.Model):
     #Atributos:
     fecha_actual = models.DateTimeField(auto_now=True, editable=False)
+    fecha_creacion = models.DateTimeField(auto_now_add=True, editable=False, db_index=True)
     informacion = models.TextField(editable=False)
-    numero = models.PositiveIntegerField(editable=False, unique=True)
-    cliente = models.OneToOneField('Cliente', on_delete=models.CASCADE)
+    numero = models.PositiveIntegerField(editable=False)
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'), editable=False)
+    insumos_descontados = models.BooleanField(default=False, editable=False)
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # Personas del grupo al abrir el ticket, para que el resumen por mesa no dependa del cliente actual.
+    cubiertos = models.PositiveIntegerField(default=0, editable=False)
+    cliente = models.ForeignKey('Cliente', on_delete=models.CASCADE, related_name='pedidos')
     #Asociacion:
     estado = models.CharField(max_length=50, choices=[(tag.name, tag.value) for tag in Estado], default=Estado.pendiente.name)
-    mesa = models.OneToOneField('Mesa', on_delete=models.CASCADE, null=True, blank=True)
+    mesa = models.ForeignKey('Mesa', on_delete=models.SET_NULL, null=True, blank=True)
+    restaurante = models.ForeignKey('Restaurante', on_delete=models.CASCADE, null=True, editable=False,
+                                    related_name='pedidos')
     item_pedido_list = models.ManyToManyField(ItemPedido, blank=True)
+    objects = PedidoQuerySet.as_manager()
+    # Estado actual -> estados a los que puede pasar.
+    TRANSICIONES = {
+        Estado.reservado.name: {Estado.pendiente.name, Estado.en_preparacion.name, Estado.servido.name},
+        Estado.pendiente.name: {Estado.en_preparacion.name, Estado.servido.name},
+        Estado.en_preparacion.name: {Estado.preparado.name},
+        Estado.preparado.name: {Estado.servido.name},
+        Estado.servido.name: {Estado.pagado.name},
+        Estado.pagado.name: set(),
+    }
     class Meta:
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
+        constraints = [models.UniqueConstraint(fields=['restaurante', 'numero'], name='pedido_restaurante_numero')]
+        indexes = [models.Index(fields=['cliente', 'estado'], condition=~Q(estado=Estado.pagado.name),
+                                name='pedido_abierto_cliente_idx')]
     #Metodos:
     def save(self, *args, **kwargs):
+        if self._state.adding and not self.cubiertos:
+            self.cubiertos = self.cliente.cantidad_persona
         if not self.numero:
-            self.numero = Pedido.objects.count() + 1
+            self.numero = Secuencia.siguiente(f'pedido:{self.restaurante_id}', lambda: Pedido.objects.filter(
+                restaurante_id=self.restaurante_id).aggregate(Max('numero'))['numero__max'] or 0, bloque=20)
         super().save(*args, **kwargs)
+
+    def puede_pasar_a(self, estado) -> bool:
+        return (estado.name if isinstance(estado, Estado) else estado) in Pedido.TRANSICIONES.get(self.estado, ())
+
+    @classmethod
+    def validar_transicion(cls, actual: str, nuevo) -> str:
+        nuevo = nuevo.name if isinstance(nuevo, Estado) else nuevo
+        if nuevo not in cls.TRANSICIONES.get(actual, ()):
+            raise ValueError(f"Transición no permitida: {actual} -> {nuevo}")
+        return nuevo
+
+    def transicionar(self, estado, **campos) -> bool:
+        # UPDATE ... WHERE estado = <el que este objeto conoce>: si otro proceso cambio el estado antes,
+        # no se actualiza ninguna fila y se devuelve False en lugar de pisar su cambio. campos se escriben
+        # en el mismo UPDATE.
+        nuevo = Pedido.validar_transicion(self.estado, estado)
+        if not Pedido.objects.filter(pk=self.pk, estado=self.estado).update(
+                estado=nuevo, version=F('version') + 1, fecha_actual=timezone.now(), **campos):
+            return False
+        self.estado = nuevo
+        self.version += 1
+        return True
+
+    @classmethod
+    def transicionar_lote(cls, pedidos, estado) -> list:
+        # Un UPDATE por estado de origen; devuelve los pedidos que avanzaron (los que perdieron la carrera quedan fuera).
+        por_estado = defaultdict(list)
+        for pedido in pedidos:
+            por_estado[pedido.estado].append(pedido)
+        nuevos = {actual: cls.validar_transicion(actual, estado) for actual in por_estado}
+        avanzados = []
+        if not pedidos:
+            return avanzados
+        with transaction.atomic(using=alias_de_escritura(cls, pedidos[0])):
+            for actual, grupo in por_estado.items():
+                bloqueados = set(cls.objects.select_for_update().filter(pk__in=[pedido.pk for pedido in grupo], estado=actual)
+                                 .values_list('pk', flat=True))
+                cls.objects.filter(pk__in=bloqueados).update(estado=nuevos[actual], version=F('version') + 1,
+                                                             fecha_actual=timezone.now())
+                for pedido in grupo:
+                    if pedido.pk in bloqueados:
+                        pedido.estado = nuevos[actual]
+                        pedido.version += 1
+                        avanzados.append(pedido)
+        return avanzados
+
     def agregar_item(self, item_pedido):
         self.item_pedido_list.add(item_pedido)
+        self.ajustar_total(item_pedido.cantidad * item_pedido.precio_unitario)
+
+    def ajustar_total(self, diferencia):
+        Pedido.objects.filter(pk=self.pk).update(total=F('total') + diferencia)
+        self.total += diferencia
 
     def calcular_total(self):
-        total = 0
-        for item_pedido in self.item_pedido_list.all():
-            total += item_pedido.cantidad * item_pedido.plato.precio
-        return total
+        return self.total
+
+    def recalcular_total(self):
+        # Un solo SUM(cantidad * precio_unitario) sobre los items en lugar de recorrerlos uno por uno.
+        self.total = self.item_pedido_list.aggregate(total=Coalesce(
+            Sum(F('cantidad') * F('precio_unitario'), output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+            Value(Decimal('0')), output_field=models.DecimalField(max_digits=10, decimal_places=2)))['total']
+        Pedido.objects.filter(pk=self.pk).update(total=self.total)
+        return self.total
+
+    def descontar_insumos(self):
+        # El indicador se marca de forma condicional para que el ticket descuente su receta una sola vez.
+        with transaction.atomic(using=alias_de_escritura(Pedido, self)):
+            if Pedido.objects.filter(pk=self.pk, insumos_descontados=False).update(insumos_descontados=True):
+                actualizar_existencias(consumo_de_insumos(ItemPedido.objects.filter(pedido=self)), restar=True)
+            self.insumos_descontados = True
 
     def mostrar_tiempo_espera(self, tiempo, item_pedido):
-        print(f"-> El plato de ({item_pedido.plato.nombre}) estará en {tiempo} minutos")
+        emitir(TiempoEsperaInformado(self.numero, item_pedido.plato.nombre, tiempo))
 
     def registrar_informacion(self, numero_mesa):
         if numero_mesa == 0:
 
-            self.informacion = f"| Nombre: {self.cliente.nombre} | Fecha: {self.fecha_actual} | Pedido: {self.numero} | Para Llevar: {self.cliente.es_para_llevar} | Total: {self.calcular_total()} |"
+            self.informacion = f"| Nombre: {self.cliente.nombre} | Fecha: {self.fecha_creacion} | Pedido: {self.numero} | Para Llevar: {self.cliente.es_para_llevar} | Total: {self.calcular_total()} |"
 
         else:
-            self.informacion = f"| Nombre: {self.cliente.nombre} | Fecha: {self.fecha_actual} | Pedido: {self.numero} | Nro.Personas: {self.cliente.get_cantidad_personas()} | Para Llevar: {self.cliente.es_para_llevar()} | Mesa: {numero_mesa} | Total: {self.calcular_total()} |"
+            self.informacion = f"| Nombre: {self.cliente.nombre} | Fecha: {self.fecha_creacion} | Pedido: {self.numero} | Nro.Personas: {self.cliente.get_cantidad_personas()} | Para Llevar: {self.cliente.es_para_llevar} | Mesa: {numero_mesa} | Total: {self.calcular_total()} |"
 
     def remover_item(self, item_pedido):
-        if item_pedido in self.item_pedido_list.all():
+        if self.item_pedido_list.filter(pk=item_pedido.pk).exists():
             self.item_pedido_list.remove(item_pedido)
+            self.ajustar_total(-item_pedido.cantidad * item_pedido.precio_unitario)
 
     def __str__(self):
         return f"Pedido: {self.numero}"
@@ -266,18 +888,36 @@ class Historial(models.Model):
     def agregar_pedido(self, pedido, numero_mesa):
         self.pedidos.add(pedido)
         pedido.registrar_informacion(numero_mesa)
-        print(f"--> Pedido {pedido.numero} agregado al historial del cliente.")
+        emitir(PedidoAgregadoHistorial(pedido.numero))
 
-    def mostrar_informacion(self):
-        if not self.pedidos.exists():
-            print("¡El cliente no tiene pedidos en su historial!")
+    def mostrar_informacion(self, tamano=100):
+        # Un evento por pagina del historial, asi nunca se arma el historial completo en memoria.
+        if not self.pedidos.para_reporte().exists():
+            emitir(ListadoMostrado('historial', ("¡El cliente no tiene pedidos en su historial!",)))
         else:
-            print("---------------------------------------------- Historial de pedidos ----------------------------------------------")
-            for pedido in self.pedidos.all():
-                print(pedido.informacion)
+            emitir(ListadoMostrado('historial', ("---------------------------------------------- Historial de pedidos ----------------------------------------------",)))
+            filas = self.iterar_pedidos(tamano=tamano)
+            while pagina := tuple(itertools.islice(filas, tamano)):
+                emitir(ListadoMostrado('historial', tuple(fila['informacion'] for fila in pagina)))
+
+    def iterar_pedidos(self, desde=None, hasta=None, estados=None, tamano=100):
+        return self.pedidos.para_reporte().filtrar(desde, hasta, estados).iterar(tamano)
+
+    def pagina_pedidos(self, despues_de=None, tamano=100, desde=None, hasta=None, estados=None) -> list:
+        return self.pedidos.para_reporte().filtrar(desde, hasta, estados).pagina(despues_de, tamano)
     def __str__(self):
         return str(self.id)+' | '+self.cliente.nombre
 
+def en_hilo_propio(funcion):
+    # Version asincrona de una lectura que corre en un hilo del pool con su propia conexion (cerrada al
+    # terminar), asi varias lecturas independientes se solapan. Solo para consultas de lectura: no ven
+    # escrituras sin confirmar de otro hilo, y con SQLite en memoria cada hilo tendria una base distinta.
+    def ejecutar(*args, **kwargs):
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return sync_to_async(ejecutar, thread_sensitive=False)
 
 class Restaurante(InteraccionCliente):
     #Atributos:
@@ -285,9 +925,6 @@ class Restaurante(InteraccionCliente):
     #Asociacion:
     meseros = models.ManyToManyField(Mesero, blank=True, related_name='restaurantes')
     personal_cocina_list = models.ManyToManyField(PersonalCocina, blank=True, related_name='restaurantes')
-    clientes = models.ManyToManyField(Cliente, blank=True)
-    pedidos = models.ManyToManyField(Pedido, blank=True)
-    mesas = models.ManyToManyField('Mesa', blank=True)
     menu = models.OneToOneField('Menu', on_delete=models.CASCADE, null=True, blank=True)
     registro_historico = models.OneToOneField('RegistroHistorico', on_delete=models.CASCADE, null=True,
                                               editable=False, related_name='restaurante')
@@ -317,135 +954,301 @@ class Restaurante(InteraccionCliente):
         self.personal_cocina_list.add(personal_cocina)
 
     def mostrar_historial(self, *cedulas_clientes):
-        for cedula_cliente in cedulas_clientes:
-            cliente_historial = self.comprobar_cliente(cedula_cliente)
-            if cliente_historial is None:
-                print("¡El cliente ingresado no existe dentro de la lista de clientes!")
-            else:
-                cliente_historial.historial.mostrar_informacion()
+        with en_reporte():
+            clientes = self.comprobar_clientes(*cedulas_clientes)
+            for cedula_cliente in cedulas_clientes:
+                cliente_historial = clientes.get(cedula_cliente)
+                if cliente_historial is None:
+                    emitir(ClienteNoEncontrado(cedula_cliente))
+                else:
+                    cliente_historial.historial.mostrar_informacion()
+
+    def planificar_cocina(self):
+        # Los pedidos pendientes salen en orden de llegada y cada uno va al cocinero que queda libre antes
+        # (monticulo por minuto de fin), asi la espera informada incluye la cola que ya tiene la cocina. Cada
+        # cocinero arranca con lo que le queda de sus pedidos en preparacion (minutos de sus items menos los ya
+        # transcurridos desde que empezo el primero), calculado en una sola consulta agregada.
+        en_preparacion = Q(pedidos__estado=Estado.en_preparacion.name)
+        ahora = timezone.now()
+        cocineros = []
+        for cocinero in self.personal_cocina_list.annotate(
+                cola=Coalesce(Sum(F('pedidos__item_pedido_list__cantidad') * F('pedidos__item_pedido_list__plato__tiempo_preparacion'),
+                                  filter=en_preparacion), 0),
+                inicio=Min('pedidos__fecha_actual', filter=en_preparacion)):
+            transcurrido = int((ahora - cocinero.inicio).total_seconds() // 60) if cocinero.inicio else 0
+            cocineros.append((max(0, cocinero.cola - transcurrido), cocinero.pk, cocinero))
+        if not cocineros:
+            emitir(SinPersonalCocina(self.nombre))
+            return []
+        heapq.heapify(cocineros)
+        planificacion = []
+        # Los numeros se reparten por bloques en cada proceso, asi que el orden de llegada es la fecha de creacion.
+        for pedido in self.pedidos.filter(estado=Estado.pendiente.name).order_by('fecha_creacion', 'numero'):
+            libre, pk, cocinero = heapq.heappop(cocineros)
+            fin = cocinero.preparar_pedido(pedido, libre)
+            if fin is None:
+                heapq.heappush(cocineros, (libre, pk, cocinero))
+                continue
+            planificacion.append((pedido, cocinero, fin))
+            heapq.heappush(cocineros, (fin, pk, cocinero))
+        return planificacion
 
     def mostrar_mesas_disponibles(self):
-        print("<------------ Mesas Disponibles ------------>")
-        for mesa in self.mesas.all():
-            if mesa.esta_disponible:
-                print(f"| Mesa: {mesa.numero} | Capacidad: {mesa.capacidad} | <- Esta disponible")
-        print("_____________________________________________")
+        emitir(ListadoMostrado('mesas_disponibles', (
+            "<------------ Mesas Disponibles ------------>",
+            *[f"| Mesa: {mesa.numero} | Capacidad: {mesa.capacidad} | <- Esta disponible"
+              for mesa in self.mesas.all() if mesa.esta_disponible],
+            "_____________________________________________")))
 
     def mostrar_registro_historico(self):
-        self.registro_historico.mostrar_lista_pedidos()
+        with en_reporte():
+            self.registro_historico.mostrar_lista_pedidos()
+
+    def agregar_mesa(self, capacidad: int):
+        return Mesa.objects.create(capacidad=capacidad, restaurante=self)
 
     def remover_mesa(self, *numeros):
-        for numero in numeros:
-            for mesa in self.mesas.all():
-                if mesa.numero == numero:
-                    self.mesas.remove(mesa)
+        self.mesas.filter(numero__in=numeros).update(restaurante=None)
     def __str__(self):
         return self.nombre
     #Interfaz:
     def gestionar_entrega_pedido(self, mesero: 'Mesero', cliente: 'Cliente', pedido: 'Pedido'):
-        mesero.entregar_pedido(pedido)
         mesero.esta_ocupado = False
-        print(f"--> El pedido {pedido.numero} fue gestionado y entregado por {mesero.nombre}")
+        if mesero.entregar_pedido(pedido):
+            emitir(EntregaGestionada(pedido.numero, mesero.nombre))
     def comprobar_cliente(self, cedula_cliente: str) -> Cliente:
-        cliente = None
-        for cliente in self.clientes.all():
-            if cliente.cedula == cedula_cliente:
-                return cliente
-        return None if not isinstance(cliente, Cliente) else cliente
+        return self.comprobar_clientes(cedula_cliente).get(cedula_cliente)
+    def comprobar_clientes(self, *cedulas_clientes: str) -> dict:
+        # Una sola consulta por el indice unico de cedula; el diccionario sirve de mapa de identidad
+        # para que una misma operacion nunca cargue dos veces al mismo cliente.
+        clientes = self.clientes.select_related('historial', 'mesa').filter(cedula__in=set(cedulas_clientes))
+        return {cliente.cedula: cliente for cliente in clientes}
     def agregar_cliente(self, nombre: str, cedula: str, telefono: str):
         cliente_nuevo = self.comprobar_cliente(cedula)
         if cliente_nuevo is None:
-            cliente = Cliente(nombre=nombre, cedula=cedula, telefono=telefono)
+            cliente = Cliente(nombre=nombre, cedula=cedula, telefono=telefono, restaurante=self)
             cliente.save()
-            self.clientes.add(cliente)
         else:
-            print(
-                f"¡No se pudo agregar al cliente {nombre} debido a que la cédula ya pertenece al cliente {cliente_nuevo.nombre}!")
+            emitir(ClienteDuplicado(nombre, cliente_nuevo.nombre))
 
     def anotar_pedido(self, cedula_cliente: str, es_para_llevar: bool, plato_escogido: str, cantidad: int,
                       observacion: str):
         cliente_pedido = self.comprobar_cliente(cedula_cliente)
+        self.tomar_orden(cedula_cliente, cliente_pedido, es_para_llevar, plato_escogido, cantidad, observacion)
+
+    def tomar_orden(self, cedula_cliente: str, cliente_pedido: 'Cliente', es_para_llevar: bool, plato_escogido: str, cantidad: int,
+                    observacion: str, plato: 'Plato' = None):
+        # plato puede llegar ya resuelto (aanotar_pedido lo busca en paralelo con el cliente).
         if cliente_pedido is None:
-            print("¡El cliente ingresado no existe dentro de la lista de clientes!")
+            emitir(ClienteNoEncontrado(cedula_cliente))
         else:
             if cliente_pedido.mesa is not None or es_para_llevar:
-                plato_encontrado = False
-                for plato in self.menu.platos:
-                    if plato_escogido.lower() == plato.nombre.lower():
-                        cliente_pedido.realizar_pedido(es_para_llevar, plato, cantidad, observacion)
-                        plato_encontrado = True
-                        break
-                if not plato_encontrado:
-                    print(f"¡No se encontró ({plato_escogido}) dentro del menú!")
+                plato = plato or self.menu.buscar_plato(plato_escogido)
+                if plato is None:
+                    emitir(PlatoNoEncontrado(plato_escogido))
+                else:
+                    cliente_pedido.realizar_pedido(es_para_llevar, plato, cantidad, observacion)
             else:
-                print(f"¡No se puede tomar la orden a {cliente_pedido.nombre} ya que no tiene mesa asignada!")
+                emitir(OrdenRechazada(cliente_pedido.nombre))
+
+    def anotar_pedidos(self, cedula_cliente: str, es_para_llevar: bool, *lineas):
+        # Ticket completo: lineas son tuplas (plato_escogido, cantidad, observacion).
+        cliente_pedido = self.comprobar_cliente(cedula_cliente)
+        if cliente_pedido is None:
+            emitir(ClienteNoEncontrado(cedula_cliente))
+        elif cliente_pedido.mesa is None and not es_para_llevar:
+            emitir(OrdenRechazada(cliente_pedido.nombre))
+        else:
+            platos = []
+            for plato_escogido, cantidad, observacion in lineas:
+                plato = self.menu.buscar_plato(plato_escogido)
+                if plato is None:
+                    emitir(PlatoNoEncontrado(plato_escogido))
+                else:
+                    platos.append((plato, cantidad, observacion))
+            if platos:
+                cliente_pedido.realizar_pedidos(es_para_llevar, platos)
 
     def asignar_mesa(self, cedula_cliente: str, cantidad_persona: int):
         cliente_mesa = self.comprobar_cliente(cedula_cliente)
         if cliente_mesa is None:
-            print("¡El cliente ingresado no existe dentro de la lista de clientes!")
+            emitir(ClienteNoEncontrado(cedula_cliente))
         else:
-            mesa_asignada = False
             if cliente_mesa.mesa is None:
-                for mesa in self.mesas.all():
-                    if mesa.esta_disponible and (mesa.capacidad == cantidad_persona or mesa.capacidad == (
-                            cantidad_persona + 1)) and not mesa_asignada:
-                        mesa.reservar()
-                        cliente_mesa.ocupar_mesa(mesa)
-                        cliente_mesa.visualizar_mesa_asignada()
-                        cliente_mesa.cantidad_persona = cantidad_persona
-                        self.mostrar_menu()
-                        mesa_asignada = True
+                mesa = self.reclamar_mesa(cantidad_persona)
+                if mesa is None:
+                    emitir(SinMesaDisponible(cliente_mesa.nombre))
+                    self.agregar_a_espera(cliente_mesa, cantidad_persona)
+                else:
+                    self.sentar_cliente(cliente_mesa, mesa, cantidad_persona)
+                    self.mostrar_menu()
             else:
-                print(f"¡El cliente ya tiene reservada la mesa {cliente_mesa.mesa.numero}!")
-
-            if cliente_mesa.mesa is None and not mesa_asignada:
-                print(f"¡No hay mesas disponibles por el momento para el cliente {cliente_mesa.nombre}!")
+                emitir(MesaYaAsignada(cliente_mesa.nombre, cliente_mesa.mesa.numero))
+
+    def asignar_mesas(self, *grupos):
+        # Sienta una lista de espera completa (pares cedula, cantidad de personas) en una sola pasada:
+        # las mesas libres se cargan una vez y se agrupan por capacidad.
+        clientes = self.comprobar_clientes(*(cedula for cedula, _ in grupos))
+        capacidades = {cantidad + extra for _, cantidad in grupos for extra in (0, 1)}
+        mesas_libres = defaultdict(deque)
+        for mesa in self.mesas.filter(esta_disponible=True, capacidad__in=capacidades).order_by('numero'):
+            mesas_libres[mesa.capacidad].append(mesa)
+        hubo_asignacion = False
+        for cedula_cliente, cantidad_persona in grupos:
+            cliente_mesa = clientes.get(cedula_cliente)
+            if cliente_mesa is None:
+                emitir(ClienteNoEncontrado(cedula_cliente))
+            elif cliente_mesa.mesa is not None:
+                emitir(MesaYaAsignada(cliente_mesa.nombre, cliente_mesa.mesa.numero))
+            else:
+                mesa = self.tomar_mesa_libre(mesas_libres, cantidad_persona)
+                if mesa is None:
+                    emitir(SinMesaDisponible(cliente_mesa.nombre))
+                    self.agregar_a_espera(cliente_mesa, cantidad_persona)
+                else:
+                    self.sentar_cliente(cliente_mesa, mesa, cantidad_persona)
+                    hubo_asignacion = True
+        if hubo_asignacion:
+            self.mostrar_menu()
+
+    def reclamar_mesa(self, cantidad_persona: int, *numeros: int):
+        # Mesas libres de capacidad n o n+1 (indice esta_disponible, capacidad), la mas ajustada primero.
+        # Si otro anfitrion gana la reserva condicional se vuelve a consultar; la mesa perdida ya no aparece.
+        mesas = self.mesas.filter(esta_disponible=True, capacidad__in=(cantidad_persona, cantidad_persona + 1))
+        if numeros:
+            mesas = mesas.filter(numero__in=numeros)
+        mesas = mesas.order_by('capacidad', 'numero')
+        while True:
+            mesa = mesas.first()
+            if mesa is None or mesa.reservar():
+                return mesa
+
+    @staticmethod
+    def tomar_mesa_libre(mesas_libres, cantidad_persona: int):
+        for capacidad in (cantidad_persona, cantidad_persona + 1):
+            while mesas_libres[capacidad]:
+                mesa = mesas_libres[capacidad].popleft()
+                if mesa.reservar():
+                    return mesa
+        return None
+
+    def agregar_a_espera(self, cliente: 'Cliente', cantidad_persona: int):
+        _, creada = EsperaMesa.objects.get_or_create(cliente=cliente, defaults={'restaurante': self,
+                                                                                'cantidad_persona': cantidad_persona})
+        if creada:
+            emitir(GrupoEnEspera(cliente.nombre, cantidad_persona))
+
+    def sentar_cliente(self, cliente: 'Cliente', mesa: 'Mesa', cantidad_persona: int):
+        cliente.cantidad_persona = cantidad_persona
+        cliente.ocupar_mesa(mesa)
+        # Un grupo que consigue mesa por otra via deja la lista de espera.
+        EsperaMesa.objects.filter(cliente=cliente).delete()
+        cliente.visualizar_mesa_asignada()
 
     def atender_pedido(self, *cedula_clientes: str):
+        clientes = self.comprobar_clientes(*cedula_clientes)
         for cedula_cliente in cedula_clientes:
-            cliente_atender = self.comprobar_cliente(cedula_cliente)
+            cliente_atender = clientes.get(cedula_cliente)
             if cliente_atender is None:
-                print("¡El cliente ingresado no existe dentro de la lista de clientes!")
+                emitir(ClienteNoEncontrado(cedula_cliente))
             else:
                 if (cliente_atender.realizo_pedido and cliente_atender.es_para_llevar or
                         cliente_atender.realizo_pedido and not cliente_atender.es_para_llevar and cliente_atender.mesa is not None
-                        and cliente_atender.item_pedido_list.exists()):
-                    print(f"---> Atendiendo a {cliente_atender.nombre} <---")
-                    for empleado in self.empleados:
-                        if isinstance(empleado, Mesero):
-                            mesero = empleado
-                            if not mesero.esta_ocupado:
-                                mesero.esta_ocupado = True
-                                i = False
-                                for pedido in self.pedidos.all():
-                                    if pedido.cliente == cliente_atender and pedido.estado == Estado.reservado.name:
-                                        self.gestionar_pedido(cliente_atender, pedido)
-                                        self.gestionar_entrega_pedido(mesero, cliente_atender, pedido)
-                                        i = True
-                                if not i:
-                                    pedido = Pedido(cliente=cliente_atender)
-                                    pedido.save()
-                                    self.registro_historico.registrar_pedido(pedido)
-                                    self.pedidos.add(pedido)
-                                    self.gestionar_pedido(cliente_atender, pedido)
-                                    self.gestionar_entrega_pedido(mesero, cliente_atender, pedido)
+                        and cliente_atender.item_pedido_list.filter(pedido=None).exists()):
+                    emitir(AtencionIniciada(cliente_atender.nombre))
+                    mesero = self.meseros.filter(esta_ocupado=False).first()
+                    if mesero is not None:
+                        mesero.esta_ocupado = True
+                        i = False
+                        for pedido in self.pedidos.abiertos_de(cliente_atender, Estado.reservado.name):
+                            self.gestionar_pedido(cliente_atender, pedido)
+                            self.gestionar_entrega_pedido(mesero, cliente_atender, pedido)
+                            i = True
+                        if not i:
+                            pedido = Pedido(cliente=cliente_atender, mesa=cliente_atender.mesa, restaurante=self)
+                            pedido.save()
+                            self.registro_historico.registrar_pedido(pedido)
+                            self.gestionar_pedido(cliente_atender, pedido)
+                            self.gestionar_entrega_pedido(mesero, cliente_atender, pedido)
                 elif (cliente_atender.realizo_pedido and not cliente_atender.es_para_llevar and
                       cliente_atender.mesa is None) or (not cliente_atender.realizo_pedido and
                                                         cliente_atender.mesa is None):
-                    print(f"¡No se puede atender a {cliente_atender.nombre} ya que no tiene mesa asignada!")
+                    emitir(AtencionRechazada(cliente_atender.nombre, "no tiene mesa asignada"))
                 elif not cliente_atender.realizo_pedido:
-                    print(f"¡No se puede atender a {cliente_atender.nombre} ya que no ha realizado ningún pedido aún!")
+                    emitir(AtencionRechazada(cliente_atender.nombre, "no ha realizado ningún pedido aún"))
 
     def gestionar_pedido(self, cliente: 'Cliente', pedido: 'Pedido'):
         pedido.item_pedido_list.clear()  # Limpiar la lista actual
-        for item in cliente.item_pedido_list.all():
-            pedido.item_pedido_list.add(item)  # Agregar cada item del cliente al pedido
-        print(f"--> El pedido ({pedido.numero}) del cliente {cliente.nombre} ahora está en proceso")
-
-    def mostrar_cuenta(self, cliente: 'Cliente', pedido: 'Pedido'):
-        print(f"--> Total a pagar: ${pedido.calcular_total()}")
-        cliente.realizar_pago(pedido.calcular_total(), pedido)
+        # Agregar en un solo insert los items del cliente que no estan ya en otro de sus tickets abiertos
+        pedido.item_pedido_list.add(*cliente.item_pedido_list.filter(pedido=None))
+        pedido.recalcular_total()
+        pedido.descontar_insumos()
+        emitir(PedidoGestionado(pedido.numero, cliente.nombre))
+
+    def mostrar_cuenta(self, cliente: 'Cliente', pedido: 'Pedido') -> bool:
+        if not pedido.puede_pasar_a(Estado.pagado):
+            emitir(CobroRechazado(pedido.numero, cliente.nombre, pedido.estado))
+            return False
+        total = pedido.calcular_total()
+        emitir(CuentaPresentada(pedido.numero, cliente.nombre, total))
+        return cliente.realizar_pago(total, pedido)
+
+    def compartir_mesa(self, cedula_cliente: str, numero_mesa: int):
+        # Sienta a un cliente en una mesa ya ocupada como parte del grupo, con cuenta separada: pide y paga sus
+        # propios tickets. Los cubiertos siguen contados en el cliente que ocupo la mesa.
+        cliente_mesa = self.comprobar_cliente(cedula_cliente)
+        if cliente_mesa is None:
+            emitir(ClienteNoEncontrado(cedula_cliente))
+        elif cliente_mesa.mesa is not None:
+            emitir(MesaYaAsignada(cliente_mesa.nombre, cliente_mesa.mesa.numero))
+        else:
+            mesa = self.mesas.filter(numero=numero_mesa, esta_disponible=False, clientes__isnull=False).first()
+            if mesa is None:
+                emitir(MesaNoCompartible(cliente_mesa.nombre, numero_mesa))
+            else:
+                self.sentar_cliente(cliente_mesa, mesa, 0)
+
+    def dividir_cuenta(self, numero_mesa: int) -> dict:
+        # Cuenta servida de la mesa separada por cliente (cedula -> total de sus tickets servidos). Cada parte
+        # se cobra con los tickets de su cliente: mostrar_cuenta uno por uno o cerrar_mesas para toda la mesa.
+        return dict(self.pedidos.filter(mesa__numero=numero_mesa, estado=Estado.servido.name)
+                    .values('cliente__cedula').annotate(total=Sum('total')).order_by('cliente__cedula')
+                    .values_list('cliente__cedula', 'total'))
+
+    def cerrar_mesas(self, *numeros_mesas: int) -> list:
+        # Cobra en una transaccion todos los pedidos servidos de las mesas, cada uno a su cliente: un UPDATE
+        # por estado (pagado), uno para la informacion, un insert para los historiales, una escritura por tabla
+        # para items y clientes, una acumulacion por fila de resumen de ventas y un UPDATE por mesa liberada.
+        mesas = list(self.mesas.filter(numero__in=numeros_mesas))
+        pedidos = list(self.pedidos.filter(mesa__in=mesas, estado=Estado.servido.name).select_related('cliente', 'mesa'))
+        alias = alias_de_escritura(Restaurante, self)
+        liberadas = []
+
+        def informar():
+            for pedido in pagados:
+                emitir(PagoRealizado(pedido.numero, pedido.cliente.nombre, pedido.total))
+                emitir(PedidoAgregadoHistorial(pedido.numero))
+            for mesa, nombre in liberadas:
+                emitir(MesaDesocupada(nombre, mesa.numero))
+
+        with transaction.atomic(using=alias):
+            pagados = Pedido.transicionar_lote(pedidos, Estado.pagado)
+            # Igual que en realizar_pago, los avisos del cobro salen antes de sentar a la lista de espera.
+            transaction.on_commit(informar, using=alias)
+            for pedido in pagados:
+                pedido.registrar_informacion(pedido.mesa.numero)
+            Pedido.objects.bulk_update(pagados, ['informacion'])
+            Historial.pedidos.through.objects.bulk_create([
+                Historial.pedidos.through(historial_id=pedido.cliente.historial_id, pedido_id=pedido.pk) for pedido in pagados])
+            registrar_ventas([(pedido, pedido.mesa) for pedido in pagados])
+            clientes = [pedido.cliente_id for pedido in pagados]
+            ItemPedido.objects.filter(pedido__in=pagados).update(cliente=None)
+            Cliente.objects.filter(pk__in=clientes).update(mesa=None)
+            ocupantes = {pedido.mesa: pedido.cliente.nombre for pedido in pagados}
+            sentados = set(Cliente.objects.filter(mesa__in=ocupantes).values_list('mesa_id', flat=True))
+            liberadas.extend((mesa, nombre) for mesa, nombre in ocupantes.items()
+                             if mesa.pk not in sentados and mesa.desocupar())
+        return pagados
 
     def mostrar_menu(self):
         self.menu.mostrar_platos()
@@ -453,93 +1256,845 @@ class Restaurante(InteraccionCliente):
     def realizar_reserva(self, cedula_cliente: str, cantidad_persona: int, *numeros: int):
         cliente_reservar = self.comprobar_cliente(cedula_cliente)
         if cliente_reservar is None:
-            print("¡El cliente ingresado no existe dentro de la lista de clientes!")
+            emitir(ClienteNoEncontrado(cedula_cliente))
         else:
             for numero in numeros:
-                for mesa in self.mesas.all():
-                    if (mesa.numero == numero and mesa.esta_disponible and
-                            (mesa.capacidad == cantidad_persona or mesa.capacidad == (cantidad_persona + 1))):
-                        mesa.reservar()
-                        cliente_reservar.ocupar_mesa(mesa)
-                        cliente_reservar.cantidad_persona = cantidad_persona
-                        pedido = Pedido(cliente=cliente_reservar)
-                        pedido.estado = Estado.reservado.name
-                        pedido.save()
-                        self.registro_historico.registrar_pedido(pedido)
-                        self.pedidos.add(pedido)
-                        print(f"{{ La mesa {numero} está ahora reservada para {cliente_reservar.nombre} }}")
-                        return
-                print(f"La mesa {numero} no está disponible por el momento")
+                mesa = self.reclamar_mesa(cantidad_persona, numero)
+                if mesa is not None:
+                    cliente_reservar.cantidad_persona = cantidad_persona
+                    cliente_reservar.ocupar_mesa(mesa)
+                    pedido = Pedido(cliente=cliente_reservar, mesa=mesa, restaurante=self)
+                    pedido.estado = Estado.reservado.name
+                    pedido.save()
+                    self.registro_historico.registrar_pedido(pedido)
+                    emitir(MesaReservada(cliente_reservar.nombre, numero))
+                    return
+                emitir(ReservaNoDisponible(cliente_reservar.nombre, numero))
+
+    #Interfaz asincrona:
+    # Las escrituras corren en el hilo sincrono compartido (thread_sensitive) para conservar sus transacciones;
+    # las busquedas de solo lectura independientes (cliente y plato) corren a la vez con en_hilo_propio().
+    # asignar_mesa, atender_pedido, mostrar_cuenta y realizar_reserva leen y escriben en secuencia dentro de la
+    # operacion, asi que sus versiones asincronas solo liberan el bucle de eventos mientras se ejecutan.
+    async def acomprobar_cliente(self, cedula_cliente: str):
+        return await en_hilo_propio(self.comprobar_cliente)(cedula_cliente)
+
+    async def abuscar_plato(self, plato_escogido: str):
+        return await en_hilo_propio(lambda: self.menu.buscar_plato(plato_escogido))()
+
+    async def aagregar_cliente(self, nombre: str, cedula: str, telefono: str):
+        return await sync_to_async(self.agregar_cliente)(nombre, cedula, telefono)
+
+    async def aanotar_pedido(self, cedula_cliente: str, es_para_llevar: bool, plato_escogido: str, cantidad: int,
+                             observacion: str):
+        cliente_pedido, plato = await asyncio.gather(self.acomprobar_cliente(cedula_cliente),
+                                                     self.abuscar_plato(plato_escogido))
+        return await sync_to_async(self.tomar_orden)(cedula_cliente, cliente_pedido, es_para_llevar, plato_escogido,
+                                                     cantidad, observacion, plato)
+
+    async def aasignar_mesa(self, cedula_cliente: str, cantidad_persona: int):
+        return await sync_to_async(self.asignar_mesa)(cedula_cliente, cantidad_persona)
+
+    async def aatender_pedido(self, *cedula_clientes: str):
+        return await sync_to_async(self.atender_pedido)(*cedula_clientes)
+
+    async def amostrar_cuenta(self, cliente: 'Cliente', pedido: 'Pedido'):
+        return await sync_to_async(self.mostrar_cuenta)(cliente, pedido)
+
+    async def arealizar_reserva(self, cedula_cliente: str, cantidad_persona: int, *numeros: int):
+        return await sync_to_async(self.realizar_reserva)(cedula_cliente, cantidad_persona, *numeros)
+
+#Variantes de imagen (lado maximo en pixeles) y formatos generados para cada una:
+VARIANTES_IMAGEN = {'miniatura': 160, 'tableta': 800}
+FORMATOS_IMAGEN = {'webp': 'WEBP', 'jpg': 'JPEG'}
+_procesador_imagenes = ThreadPoolExecutor(max_workers=2, thread_name_prefix='variantes-plato')
+
+def ruta_variante_imagen(huella: str, variante: str, extension: str) -> str:
+    return f"platos/variantes/{huella}_{variante}.{extension}"
+
+def generar_variantes_imagen(huella: str, contenido: bytes):
+    # Las variantes se nombran por el hash del contenido: si la misma imagen ya se proceso, no se hace nada.
+    from PIL import Image
+
+    pendientes = [(variante, extension) for variante in VARIANTES_IMAGEN for extension in FORMATOS_IMAGEN
+                  if not default_storage.exists(ruta_variante_imagen(huella, variante, extension))]
+    if not pendientes:
+        return
+    with Image.open(io.BytesIO(contenido)) as original:
+        original = original.convert('RGB')
+        for variante, extension in pendientes:
+            copia = original.copy()
+            copia.thumbnail((VARIANTES_IMAGEN[variante], VARIANTES_IMAGEN[variante]))
+            salida = io.BytesIO()
+            copia.save(salida, FORMATOS_IMAGEN[extension], quality=80)
+            default_storage.save(ruta_variante_imagen(huella, variante, extension), ContentFile(salida.getvalue()))
+    # Las URLs de las variantes cambian: los menus renderizados con la imagen original quedan obsoletos.
+    Menu.subir_version(Menu.objects.filter(platos__imagen_hash=huella))
+
+def procesar_variantes_imagen(huella: str, contenido: bytes):
+    # Encola la generacion; un fallo (imagen corrupta, error de Pillow o del almacenamiento) se registra en el
+    # log, ya que nadie espera el resultado y el menu seguiria sirviendo el original sin aviso.
+    def informar(futuro):
+        error = futuro.exception()
+        if error is not None:
+            logging.getLogger(__name__).error("No se pudieron generar las variantes de la imagen %s", huella,
+                                              exc_info=error)
+    _procesador_imagenes.submit(generar_variantes_imagen, huella, contenido).add_done_callback(informar)
+
 class Plato(models.Model):
     #Atributos:
     nombre = models.CharField(max_length=50, unique=True)
     precio = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0)])
     imagen = models.ImageField(upload_to='platos/', null=True, blank=True)
+    imagen_hash = models.CharField(max_length=64, blank=True, editable=False)
+    tiempo_preparacion = models.PositiveIntegerField(default=10, help_text="Minutos de preparación")
     class Meta:
         verbose_name = "Plato"
         verbose_name_plural = "Platos"
     #Metodos:
+    def save(self, *args, **kwargs):
+        contenido = None
+        if self.imagen and not self.imagen._committed:
+            contenido = self.imagen.read()
+            self.imagen.seek(0)
+            self.imagen_hash = hashlib.sha256(contenido).hexdigest()
+        super().save(*args, **kwargs)
+        if contenido is not None:
+            # Pillow libera el GIL al redimensionar y codificar, asi que un pool de hilos basta y no bloquea la peticion.
+            huella = self.imagen_hash
+            transaction.on_commit(lambda: procesar_variantes_imagen(huella, contenido), using=self._state.db)
+
+    def url_imagen(self, variante='tableta', extension='webp'):
+        if not self.imagen:
+            return None
+        if self.imagen_hash:
+            ruta = ruta_variante_imagen(self.imagen_hash, variante, extension)
+            if default_storage.exists(ruta):
+                return default_storage.url(ruta)
+        return self.imagen.url
+
     def __str__(self):
         return self.nombre+' | '+str(self.precio)
 
 
+class Receta(models.Model):
+    #Atributos:
+    cantidad = models.DecimalField(max_digits=10, decimal_places=3, validators=[MinValueValidator(0)])
+    #Asociacion:
+    plato = models.ForeignKey(Plato, on_delete=models.CASCADE, related_name='recetas')
+    insumo = models.ForeignKey(Insumo, on_delete=models.CASCADE, related_name='recetas')
+    class Meta:
+        verbose_name = "Receta"
+        verbose_name_plural = "Recetas"
+        constraints = [models.UniqueConstraint(fields=['plato', 'insumo'], name='receta_plato_insumo_unica')]
+    #Metodos:
+    def __str__(self):
+        return self.plato.nombre+' | '+str(self.insumo)+' | '+str(self.cantidad)
+
+def consumo_de_insumos(items) -> dict:
+    # insumo_id -> cantidad consumida por los items dados (cantidad del item x cantidad de la receta).
+    return dict(items.filter(plato__recetas__isnull=False).values('plato__recetas__insumo')
+                .annotate(consumo=Sum(F('cantidad') * F('plato__recetas__cantidad'),
+                                      output_field=models.DecimalField(max_digits=14, decimal_places=3)))
+                .values_list('plato__recetas__insumo', 'consumo'))
+
+def actualizar_existencias(cantidades: dict, restar=False):
+    # Un solo UPDATE para todos los insumos: existencia = [existencia -] CASE id WHEN ... THEN ... END.
+    if not cantidades:
+        return
+    valor = Case(*[When(pk=insumo_id, then=Value(cantidad)) for insumo_id, cantidad in cantidades.items()],
+                 output_field=models.DecimalField(max_digits=14, decimal_places=3))
+    Insumo.objects.filter(pk__in=cantidades).update(
+        **{CAMPO_EXISTENCIA_INSUMO: F(CAMPO_EXISTENCIA_INSUMO) - valor if restar else valor})
+
+def reconciliar_inventario(existencias_base: dict) -> dict:
+    # Vuelve a derivar la existencia de cada insumo como base - consumo de todos los pedidos ya descontados.
+    consumo = consumo_de_insumos(ItemPedido.objects.filter(pedido__insumos_descontados=True))
+    existencias = {insumo_id: base - consumo.get(insumo_id, 0) for insumo_id, base in existencias_base.items()}
+    with transaction.atomic(using=alias_de_escritura(Insumo)):
+        actualizar_existencias(existencias)
+    return existencias
+
 class Menu(models.Model):
+    #Atributos:
+    version = models.PositiveIntegerField(default=0, editable=False)
     #Asociacion:
     platos = models.ManyToManyField(Plato)
+    # Indice nombre normalizado -> Plato por menu, valido mientras no cambie la version del menu.
+    _indices_platos = {}
     class Meta:
         verbose_name = "Menu"
         verbose_name_plural = "Menus"
     #Metodos:
+    @staticmethod
+    def normalizar_nombre(nombre: str) -> str:
+        descompuesto = unicodedata.normalize('NFKD', nombre.strip())
+        return ''.join(letra for letra in descompuesto if not unicodedata.combining(letra)).casefold()
+
+    @staticmethod
+    def clave_version(pk) -> str:
+        return f"menu:{pk}:version"
+
+    def version_actual(self) -> int:
+        # La version vigente se lee de la cache (o de la base si falta), no del atributo de esta instancia: los
+        # cambios hechos desde otra instancia o por las senales de Plato solo suben la columna. La copia en cache
+        # dura MENU_VERSION_TTL_S segundos: con una cache por proceso (LocMemCache) el borrado de subir_version
+        # no llega a los demas workers, y una lectura que se cruce con el borrado puede guardar la version
+        # anterior; en ambos casos el menu queda desactualizado como mucho ese tiempo.
+        version = cache.get(Menu.clave_version(self.pk))
+        if version is None:
+            version = Menu.objects.filter(pk=self.pk).values_list('version', flat=True).get()
+            cache.set(Menu.clave_version(self.pk), version, getattr(settings, 'MENU_VERSION_TTL_S', 5))
+        self.version = version
+        return version
+
+    @staticmethod
+    def subir_version(menus):
+        # Sube la version en la base y descarta la copia en cache ahora y al confirmar la transaccion; lo que
+        # una lectura concurrente deje en cache con la version anterior caduca con MENU_VERSION_TTL_S.
+        pks = list(menus.values_list('pk', flat=True))
+        if not pks:
+            return
+        Menu.objects.filter(pk__in=pks).update(version=F('version') + 1)
+        claves = [Menu.clave_version(pk) for pk in pks]
+        cache.delete_many(claves)
+        transaction.on_commit(lambda: cache.delete_many(claves), using=alias_de_escritura(Menu))
+
+    def indice_platos(self) -> dict:
+        version_actual = self.version_actual()
+        version, indice = Menu._indices_platos.get(self.pk, (None, None))
+        if version != version_actual:
+            indice = {Menu.normalizar_nombre(plato.nombre): plato for plato in self.platos.all()}
+            Menu._indices_platos[self.pk] = (version_actual, indice)
+        return indice
+
+    def buscar_plato(self, nombre: str):
+        return self.indice_platos().get(Menu.normalizar_nombre(nombre))
+
     def agregar_plato(self, nombre, precio):
-        self.platos.append(Plato(nombre=nombre, precio=precio))
+        plato, _ = Plato.objects.get_or_create(nombre=nombre, defaults={'precio': precio})
+        self.platos.add(plato)
+        return plato
 
-    def mostrar_platos(self):
-        print("|-------- Platos disponibles --------|")
-        for plato in self.platos:
-            print(f"[ Plato: {plato.nombre} | Precio: ${plato.precio} ]")
-        print("|____________________________________|")
+    def agregar_platos(self, *platos):
+        # platos: pares (nombre, precio); un insert para los platos nuevos y otro para la tabla intermedia.
+        Plato.objects.bulk_create([Plato(nombre=nombre, precio=precio) for nombre, precio in platos], ignore_conflicts=True)
+        self.platos.add(*Plato.objects.filter(nombre__in=[nombre for nombre, _ in platos]))
 
-    def remover_plato(self, plato_remover):
-        self.platos = [plato for plato in self.platos.all() if plato != plato_remover]
+    def mostrar_platos(self):
+        emitir(ListadoMostrado('menu', (self.renderizar_platos(),)))
+
+    def renderizar_platos(self, formato='texto') -> str:
+        # La clave lleva la version del menu, que sube con cualquier cambio de sus platos: nunca hay que borrarla.
+        clave = f"menu:{self.pk}:{self.version_actual()}:{formato}"
+        contenido = cache.get(clave)
+        if contenido is None:
+            platos = list(self.platos.all())
+            if formato == 'json':
+                contenido = json.dumps([{'nombre': plato.nombre, 'precio': str(plato.precio),
+                                         'tiempo_preparacion': plato.tiempo_preparacion,
+                                         'imagen': plato.url_imagen('miniatura')} for plato in platos], ensure_ascii=False)
+            else:
+                contenido = '\n'.join(["|-------- Platos disponibles --------|",
+                                       *[f"[ Plato: {plato.nombre} | Precio: ${plato.precio} ]" for plato in platos],
+                                       "|____________________________________|"])
+            cache.set(clave, contenido, None)
+        return contenido
+
+    def remover_plato(self, *platos_remover):
+        self.platos.remove(*platos_remover)
     def __str__(self):
         return str(self.id)
 
+@receiver(m2m_changed, sender=Menu.platos.through)
+def actualizar_version_menu(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action == 'pre_clear':
+            Menu.subir_version(Menu.objects.filter(platos=instance))
+        elif action in ('post_add', 'post_remove'):
+            Menu.subir_version(Menu.objects.filter(pk__in=pk_set))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        Menu.subir_version(Menu.objects.filter(pk=instance.pk))
+
+@receiver(post_save, sender=Plato)
+@receiver(pre_delete, sender=Plato)
+def actualizar_version_menus_del_plato(sender, instance, **kwargs):
+    Menu.subir_version(Menu.objects.filter(platos=instance))
+
 class Mesa(models.Model):
     #Atributos:
     capacidad = models.PositiveIntegerField(default=1)
     esta_disponible = models.BooleanField(default=True, editable=False)
-    numero = models.PositiveIntegerField(editable=False, unique=True)
+    numero = models.PositiveIntegerField(editable=False)
+    #Asociacion:
+    restaurante = models.ForeignKey('Restaurante', on_delete=models.CASCADE, null=True, editable=False,
+                                    related_name='mesas')
     class Meta:
         verbose_name = "Mesa"
         verbose_name_plural = "Mesas"
+        constraints = [models.UniqueConstraint(fields=['restaurante', 'numero'], name='mesa_restaurante_numero')]
+        indexes = [models.Index(fields=['restaurante', 'esta_disponible', 'capacidad'], name='mesa_libre_capacidad_idx')]
     #Metodos:
     def save(self, *args, **kwargs):
         if not self.numero:
-            self.numero = Mesa.objects.count() + 1
+            self.numero = Secuencia.siguiente(f'mesa:{self.restaurante_id}', lambda: Mesa.objects.filter(
+                restaurante_id=self.restaurante_id).aggregate(Max('numero'))['numero__max'] or 0)
         super().save(*args, **kwargs)
 
-    def desocupar(self):
-        self.esta_disponible = True
-        self.save()
+    def desocupar(self) -> bool:
+        # UPDATE condicional: solo quien libera la mesa ocupada sienta al siguiente grupo de la lista de espera,
+        # y lo hace cuando el cobro se confirma.
+        liberada = Mesa.objects.filter(pk=self.pk, esta_disponible=False).update(esta_disponible=True) == 1
+        if liberada:
+            self.esta_disponible = True
+            transaction.on_commit(lambda: EsperaMesa.sentar_siguiente(self), using=alias_de_escritura(Mesa, self))
+        return liberada
 
     def reservar(self):
-        self.esta_disponible = False
-        self.save()
+        # Reserva condicional: de dos anfitriones que intenten tomar la misma mesa solo uno actualiza la fila.
+        reservada = Mesa.objects.filter(pk=self.pk, esta_disponible=True).update(esta_disponible=False) == 1
+        if reservada:
+            self.esta_disponible = False
+        return reservada
     def __str__(self):
         return str(self.numero)+' | '+str(self.capacidad)+' | '+str(self.esta_disponible)
 
+class EsperaMesa(models.Model):
+    #Atributos:
+    cantidad_persona = models.PositiveIntegerField(editable=False)
+    llegada = models.DateTimeField(auto_now_add=True, editable=False)
+    #Asociacion:
+    restaurante = models.ForeignKey(Restaurante, on_delete=models.CASCADE, related_name='lista_espera')
+    cliente = models.OneToOneField(Cliente, on_delete=models.CASCADE, related_name='espera')
+    class Meta:
+        verbose_name = "Espera de Mesa"
+        verbose_name_plural = "Lista de Espera"
+        indexes = [models.Index(fields=['restaurante', 'cantidad_persona', 'llegada'], name='espera_mesa_grupo_idx')]
+    #Metodos:
+    @classmethod
+    def sentar_siguiente(cls, mesa: 'Mesa'):
+        # Con la regla de capacidad (n o n+1) una mesa libre sirve a grupos de capacidad o capacidad-1 personas;
+        # cada tamano es una busqueda en el indice (restaurante, cantidad_persona, llegada) y gana el que llego antes.
+        restaurante = mesa.restaurante
+        if restaurante is None:
+            return None
+        candidatos = [cls.objects.filter(restaurante=restaurante, cantidad_persona=cantidad, cliente__mesa__isnull=True)
+                      .select_related('cliente').order_by('llegada').first()
+                      for cantidad in (mesa.capacidad, mesa.capacidad - 1) if cantidad > 0]
+        candidatos = [espera for espera in candidatos if espera is not None]
+        if not candidatos:
+            return None
+        espera = min(candidatos, key=lambda candidato: candidato.llegada)
+        alias = alias_de_escritura(Mesa, mesa)
+        with transaction.atomic(using=alias):
+            if not cls.objects.filter(pk=espera.pk).delete()[0] or not mesa.reservar():
+                transaction.set_rollback(True, using=alias)
+                return None
+            restaurante.sentar_cliente(espera.cliente, mesa, espera.cantidad_persona)
+        return espera.cliente
+
+    def __str__(self):
+        return self.cliente.nombre+' | '+str(self.cantidad_persona)+' | '+str(self.llegada)
+
 class RegistroHistorico(models.Model):
-    pedidos = models.ManyToManyField(Pedido, editable=False, blank=True)
+    pedidos = models.ManyToManyField(Pedido, through='RegistroPedido', editable=False, blank=True)
     # Métodos:
     def registrar_pedido(self, pedido):
-        self.pedidos.add(pedido)
-        print(f"{{ Pedido {pedido.numero} guardado en el Registro del restaurante }}")
-
-    def mostrar_lista_pedidos(self):
-        print("[------- Registro Historico -------]")
-        for pedido in self.pedidos.all():
-            print(f"| Pedido: {pedido.numero} | Fecha: {pedido.fecha_actual} |")
-        print("[__________________________________]")
+        self.pedidos.add(pedido, through_defaults={'fecha': pedido.fecha_creacion})
+        emitir(PedidoRegistrado(pedido.numero))
+
+    def mostrar_lista_pedidos(self, tamano=100):
+        # Un evento por pagina, como Historial.mostrar_informacion.
+        emitir(ListadoMostrado('registro_historico', ("[------- Registro Historico -------]",)))
+        filas = self.iterar_pedidos(tamano=tamano)
+        while pagina := tuple(itertools.islice(filas, tamano)):
+            emitir(ListadoMostrado('registro_historico', tuple(f"| Pedido: {fila['numero']} | Fecha: {fila['fecha_creacion']} |"
+                                                               for fila in pagina)))
+        emitir(ListadoMostrado('registro_historico', ("[__________________________________]",)))
+
+    def pedidos_entre(self, desde=None, hasta=None):
+        # El rango se resuelve sobre el indice (registro, fecha) de la tabla intermedia.
+        vinculos = RegistroPedido.objects.filter(registro=self)
+        if desde is not None:
+            vinculos = vinculos.filter(fecha__gte=desde)
+        if hasta is not None:
+            vinculos = vinculos.filter(fecha__lt=hasta)
+        return Pedido.objects.para_reporte().filter(pk__in=vinculos.values('pedido'))
+
+    def iterar_pedidos(self, desde=None, hasta=None, estados=None, tamano=100):
+        return self.pedidos_entre(desde, hasta).filtrar(estados=estados).iterar(tamano)
+
+    def pagina_pedidos(self, despues_de=None, tamano=100, desde=None, hasta=None, estados=None) -> list:
+        return self.pedidos_entre(desde, hasta).filtrar(estados=estados).pagina(despues_de, tamano)
+
+    def archivar_hasta(self, fecha, tamano=1000) -> int:
+        # Mueve por bloques los pedidos anteriores a fecha a PedidoArchivado (una fila compacta por pedido,
+        # agrupada por periodo AAAA-MM) y los saca de la relacion viva.
+        archivados = 0
+        while True:
+            with transaction.atomic(using=alias_de_escritura(RegistroHistorico, self)):
+                vinculos = list(RegistroPedido.objects.filter(registro=self, fecha__lt=fecha)
+                                .select_related('pedido').order_by('fecha')[:tamano])
+                if not vinculos:
+                    return archivados
+                PedidoArchivado.objects.bulk_create([
+                    PedidoArchivado(registro=self, periodo=vinculo.fecha.strftime('%Y-%m'), numero=vinculo.pedido.numero,
+                                    fecha=vinculo.fecha, estado=vinculo.pedido.estado, total=vinculo.pedido.total,
+                                    informacion=vinculo.pedido.informacion)
+                    for vinculo in vinculos])
+                RegistroPedido.objects.filter(pk__in=[vinculo.pk for vinculo in vinculos]).delete()
+            archivados += len(vinculos)
+
+    def pedidos_archivados_de(self, periodo: str):
+        return self.pedidos_archivados.using(alias_de_reporte()).filter(periodo=periodo).order_by('numero')
 
     def __str__(self):
         return str(self.id) + ' | ' + self.restaurante.nombre
+
+class RegistroPedido(models.Model):
+    #Atributos:
+    fecha = models.DateTimeField(editable=False)
+    #Asociacion:
+    registro = models.ForeignKey(RegistroHistorico, on_delete=models.CASCADE)
+    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE)
+    class Meta:
+        verbose_name = "Pedido del Registro"
+        verbose_name_plural = "Pedidos del Registro"
+        constraints = [models.UniqueConstraint(fields=['registro', 'pedido'], name='registro_pedido_unico')]
+        indexes = [models.Index(fields=['registro', 'fecha'], name='registro_pedido_fecha_idx')]
+
+class PedidoArchivado(models.Model):
+    #Atributos:
+    periodo = models.CharField(max_length=7, editable=False)
+    numero = models.PositiveIntegerField(editable=False)
+    fecha = models.DateTimeField(editable=False)
+    estado = models.CharField(max_length=50, editable=False)
+    total = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+    informacion = models.TextField(editable=False)
+    #Asociacion:
+    registro = models.ForeignKey(RegistroHistorico, on_delete=models.CASCADE, related_name='pedidos_archivados')
+    class Meta:
+        verbose_name = "Pedido Archivado"
+        verbose_name_plural = "Pedidos Archivados"
+        indexes = [models.Index(fields=['registro', 'periodo'], name='pedido_archivado_periodo_idx')]
+    def __str__(self):
+        return f"Pedido: {self.numero} | {self.periodo}"
+
+class ResumenVentas(models.Model):
+    class Meta:
+        abstract = True
+    #Metodos:
+    @classmethod
+    def acumular(cls, claves: dict, **incrementos):
+        # UPDATE campo = campo + n sobre la fila del resumen; si aun no existe se crea (y si otro proceso
+        # la crea primero, se vuelve a sumar sobre la suya).
+        sumas = {campo: F(campo) + valor for campo, valor in incrementos.items()}
+        if cls.objects.filter(**claves).update(**sumas):
+            return
+        try:
+            with transaction.atomic(using=alias_de_escritura(cls)):
+                cls.objects.create(**claves, **incrementos)
+        except IntegrityError:
+            cls.objects.filter(**claves).update(**sumas)
+
+    @classmethod
+    def reporte(cls):
+        return cls.objects.using(alias_de_reporte())
+
+class VentaPlatoDia(ResumenVentas):
+    #Atributos:
+    fecha = models.DateField(editable=False)
+    unidades = models.PositiveIntegerField(default=0, editable=False)
+    ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'), editable=False)
+    #Asociacion:
+    plato = models.ForeignKey(Plato, on_delete=models.CASCADE, related_name='ventas_diarias')
+    class Meta:
+        verbose_name = "Venta de Plato por Día"
+        verbose_name_plural = "Ventas de Platos por Día"
+        constraints = [models.UniqueConstraint(fields=['plato', 'fecha'], name='venta_plato_dia_unica')]
+        indexes = [models.Index(fields=['fecha'], name='venta_plato_dia_fecha_idx')]
+
+class VentaMesaDia(ResumenVentas):
+    #Atributos:
+    fecha = models.DateField(editable=False)
+    cubiertos = models.PositiveIntegerField(default=0, editable=False)
+    ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'), editable=False)
+    #Asociacion:
+    mesa = models.ForeignKey(Mesa, on_delete=models.CASCADE, related_name='ventas_diarias')
+    class Meta:
+        verbose_name = "Venta de Mesa por Día"
+        verbose_name_plural = "Ventas de Mesas por Día"
+        constraints = [models.UniqueConstraint(fields=['mesa', 'fecha'], name='venta_mesa_dia_unica')]
+        indexes = [models.Index(fields=['fecha'], name='venta_mesa_dia_fecha_idx')]
+
+class VentaMesero(ResumenVentas):
+    #Atributos:
+    tickets = models.PositiveIntegerField(default=0, editable=False)
+    ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'), editable=False)
+    #Asociacion:
+    mesero = models.OneToOneField(Mesero, on_delete=models.CASCADE, related_name='ventas')
+    class Meta:
+        verbose_name = "Venta de Mesero"
+        verbose_name_plural = "Ventas de Meseros"
+
+def registrar_venta(pedido: 'Pedido', mesa: 'Mesa'):
+    registrar_ventas([(pedido, mesa)])
+
+def registrar_ventas(ventas: list):
+    # ventas: pares (pedido, mesa). Los incrementos de todos los pedidos se suman en memoria a partir de dos
+    # consultas (items agrupados por pedido y plato, meseros de los pedidos) y cada fila de resumen afectada
+    # se acumula una sola vez. Precios y cubiertos son los guardados al pedir, igual que en la reconstruccion.
+    importe = models.DecimalField(max_digits=12, decimal_places=2)
+    pedidos = {pedido.pk: pedido for pedido, _ in ventas}
+    fechas = {pk: timezone.localdate(pedido.fecha_creacion) if timezone.is_aware(pedido.fecha_creacion)
+              else pedido.fecha_creacion.date() for pk, pedido in pedidos.items()}
+    platos, mesas, meseros = defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+    for fila in (ItemPedido.objects.filter(pedido__in=pedidos).values('pedido', 'plato')
+                 .annotate(unidades=Sum('cantidad'), ingresos=Sum(F('cantidad') * F('precio_unitario'), output_field=importe))):
+        acumulado = platos[(fila['plato'], fechas[fila['pedido']])]
+        acumulado[0] += fila['unidades']
+        acumulado[1] += fila['ingresos']
+    for pedido, mesa in ventas:
+        if mesa is not None:
+            acumulado = mesas[(mesa.pk, fechas[pedido.pk])]
+            acumulado[0] += pedido.cubiertos
+            acumulado[1] += pedido.total
+    for mesero_id, pedido_id in Mesero.pedidos.through.objects.filter(pedido__in=pedidos).values_list('mesero_id', 'pedido_id'):
+        acumulado = meseros[mesero_id]
+        acumulado[0] += 1
+        acumulado[1] += pedidos[pedido_id].total
+    for (plato_id, fecha), (unidades, ingresos) in platos.items():
+        VentaPlatoDia.acumular({'plato_id': plato_id, 'fecha': fecha}, unidades=unidades, ingresos=ingresos)
+    for (mesa_id, fecha), (cubiertos, ingresos) in mesas.items():
+        VentaMesaDia.acumular({'mesa_id': mesa_id, 'fecha': fecha}, cubiertos=cubiertos, ingresos=ingresos)
+    for mesero_id, (tickets, ingresos) in meseros.items():
+        VentaMesero.acumular({'mesero_id': mesero_id}, tickets=tickets, ingresos=ingresos)
+
+def reconstruir_resumenes_ventas():
+    # Recalcula todos los resumenes desde el historial de pedidos pagados con tres consultas agregadas.
+    importe = models.DecimalField(max_digits=12, decimal_places=2)
+    pagados = Pedido.objects.filter(pk__in=Historial.pedidos.through.objects.values('pedido_id'))
+    with transaction.atomic(using=alias_de_escritura(VentaPlatoDia)):
+        for modelo in (VentaPlatoDia, VentaMesaDia, VentaMesero):
+            modelo.objects.all().delete()
+        VentaPlatoDia.objects.bulk_create([
+            VentaPlatoDia(plato_id=fila['item_pedido_list__plato'], fecha=fila['dia'], unidades=fila['unidades'], ingresos=fila['ingresos'])
+            for fila in pagados.filter(item_pedido_list__isnull=False).annotate(dia=TruncDate('fecha_creacion'))
+            .values('dia', 'item_pedido_list__plato')
+            .annotate(unidades=Sum('item_pedido_list__cantidad'),
+                      ingresos=Sum(F('item_pedido_list__cantidad') * F('item_pedido_list__precio_unitario'), output_field=importe))
+        ], batch_size=1000)
+        VentaMesaDia.objects.bulk_create([
+            VentaMesaDia(mesa_id=fila['mesa'], fecha=fila['dia'], cubiertos=fila['cubiertos'], ingresos=fila['ingresos'])
+            for fila in pagados.filter(mesa__isnull=False).annotate(dia=TruncDate('fecha_creacion'))
+            .values('mesa', 'dia').annotate(cubiertos=Sum('cubiertos'), ingresos=Sum('total'))
+        ], batch_size=1000)
+        VentaMesero.objects.bulk_create([
+            VentaMesero(mesero_id=fila['mesero'], tickets=fila['tickets'], ingresos=fila['ingresos'])
+            for fila in Mesero.pedidos.through.objects.filter(pedido__in=pagados)
+            .values('mesero').annotate(tickets=Count('pedido'), ingresos=Sum('pedido__total'))
+        ], batch_size=1000)
+
+class Secuencia(models.Model):
+    #Atributos:
+    nombre = models.CharField(max_length=30, unique=True)
+    valor = models.PositiveBigIntegerField(default=0)
+    _bloques = {}
+    _candado = threading.Lock()
+    class Meta:
+        verbose_name = "Secuencia"
+        verbose_name_plural = "Secuencias"
+    #Metodos:
+    @classmethod
+    def siguiente(cls, nombre: str, inicial=None, bloque: int = 1) -> int:
+        # Dentro de una transaccion el incremento comparte su suerte (un rollback no deja numeros repetidos),
+        # asi que solo se reparten bloques en memoria en modo autocommit. La clave lleva el pid para que un
+        # proceso hijo no reutilice el bloque heredado del padre, y el alias para que cada base tenga los suyos.
+        alias = alias_de_escritura(cls)
+        if transaction.get_connection(alias).in_atomic_block:
+            return cls.reservar_bloque(nombre, inicial)[1]
+        clave = (os.getpid(), alias, nombre)
+        with cls._candado:
+            actual, limite = cls._bloques.get(clave, (0, 0))
+            if actual >= limite:
+                actual, limite = cls.reservar_bloque(nombre, inicial, bloque)
+            cls._bloques[clave] = (actual + 1, limite)
+        return actual + 1
+
+    @classmethod
+    def reservar_bloque(cls, nombre: str, inicial=None, cantidad: int = 1):
+        # Devuelve el rango (inicio, limite]; se incrementa antes de leer para que el UPDATE tome el bloqueo
+        # de la fila (o de la base en SQLite) y dos escritores nunca lean el mismo valor.
+        alias = alias_de_escritura(cls)
+        with transaction.atomic(using=alias):
+            if not cls.objects.filter(nombre=nombre).update(valor=F('valor') + cantidad):
+                try:
+                    with transaction.atomic(using=alias):
+                        cls.objects.create(nombre=nombre, valor=(inicial() if inicial else 0) + cantidad)
+                except IntegrityError:
+                    cls.objects.filter(nombre=nombre).update(valor=F('valor') + cantidad)
+            limite = cls.objects.filter(nombre=nombre).values_list('valor', flat=True).get()
+        return limite - cantidad, limite
+
+    def __str__(self):
+        return self.nombre+' | '+str(self.valor)
+
+#Importacion y exportacion:
+class PuntoControlImportacion(models.Model):
+    # Filas ya importadas de un archivo; el archivo se identifica por ruta, tamano y fecha de modificacion.
+    #Atributos:
+    entidad = models.CharField(max_length=20, editable=False)
+    ruta = models.CharField(max_length=500, editable=False)
+    tamano = models.PositiveBigIntegerField(editable=False)
+    modificado_ns = models.BigIntegerField(editable=False)
+    procesadas = models.PositiveBigIntegerField(default=0, editable=False)
+    #Asociacion:
+    restaurante = models.ForeignKey(Restaurante, on_delete=models.CASCADE, related_name='importaciones')
+    class Meta:
+        verbose_name = "Punto de Control de Importación"
+        verbose_name_plural = "Puntos de Control de Importación"
+        constraints = [models.UniqueConstraint(fields=['restaurante', 'entidad', 'ruta', 'tamano', 'modificado_ns'],
+                                               name='punto_control_importacion_archivo')]
+    def __str__(self):
+        return self.entidad+' | '+self.ruta+' | '+str(self.procesadas)
+
+# Columnas de cada entidad en los archivos CSV/JSONL; al importar se ignoran las que se generan (numero, identificacion).
+CAMPOS_TRANSFERENCIA = {
+    'clientes': ('cedula', 'nombre', 'telefono'),
+    'platos': ('nombre', 'precio', 'tiempo_preparacion'),
+    'mesas': ('numero', 'capacidad'),
+    'meseros': ('identificacion', 'cedula', 'nombre', 'telefono'),
+    'personal_cocina': ('identificacion', 'cedula', 'nombre', 'telefono'),
+}
+
+def leer_filas(ruta: str):
+    with open(ruta, newline='', encoding='utf-8') as archivo:
+        if ruta.endswith('.csv'):
+            yield from csv.DictReader(archivo)
+        else:
+            for linea in archivo:
+                if linea.strip():
+                    yield json.loads(linea)
+
+def _filas_sin_repetir(filas: list, existentes) -> tuple:
+    # existentes: pares (cedula, telefono) ya guardados. Las filas con una cedula ya guardada ya estan
+    # importadas; las que repiten una cedula del lote o un telefono ya usado se omiten y se cuentan, porque
+    # insertarlas violaria la restriccion unica en cada reintento. Devuelve (filas nuevas, filas omitidas).
+    registrados = dict(existentes)
+    cedulas, telefonos = set(registrados), set(registrados.values())
+    nuevas, omitidas = [], 0
+    for fila in filas:
+        if fila['cedula'] in registrados:
+            continue
+        if fila['cedula'] in cedulas or fila['telefono'] in telefonos:
+            omitidas += 1
+            continue
+        cedulas.add(fila['cedula'])
+        telefonos.add(fila['telefono'])
+        nuevas.append(fila)
+    return nuevas, omitidas
+
+def _importar_clientes(restaurante: 'Restaurante', filas: list) -> int:
+    nuevas, omitidas = _filas_sin_repetir(filas, restaurante.clientes.filter(
+        Q(cedula__in=[fila['cedula'] for fila in filas]) | Q(telefono__in=[fila['telefono'] for fila in filas]))
+        .values_list('cedula', 'telefono'))
+    historiales = Historial.objects.bulk_create([Historial() for _ in nuevas])
+    Cliente.objects.bulk_create([Cliente(cedula=fila['cedula'], nombre=fila['nombre'], telefono=fila['telefono'],
+                                         historial=historial, restaurante=restaurante)
+                                 for fila, historial in zip(nuevas, historiales)])
+    return omitidas
+
+def _importar_platos(restaurante: 'Restaurante', filas: list):
+    Plato.objects.bulk_create([Plato(nombre=fila['nombre'], precio=Decimal(str(fila['precio'])),
+                                     tiempo_preparacion=int(fila.get('tiempo_preparacion') or 10)) for fila in filas],
+                              ignore_conflicts=True)
+    restaurante.menu.platos.add(*Plato.objects.filter(nombre__in=[fila['nombre'] for fila in filas]))
+
+def _importar_mesas(restaurante: 'Restaurante', filas: list):
+    inicio, _ = Secuencia.reservar_bloque(f'mesa:{restaurante.pk}', lambda: restaurante.mesas.aggregate(
+        Max('numero'))['numero__max'] or 0, len(filas))
+    Mesa.objects.bulk_create([Mesa(capacidad=int(fila['capacidad']), numero=inicio + posicion, restaurante=restaurante)
+                              for posicion, fila in enumerate(filas, 1)])
+
+def _importar_empleados(modelo, prefijo: str, secuencia: str, relacion):
+    # Misma identificacion que Mesero.save/PersonalCocina.save, pero con un solo bloque de la secuencia por lote.
+    def importar(restaurante: 'Restaurante', filas: list) -> int:
+        cedulas = [fila['cedula'] for fila in filas]
+        nuevas, omitidas = _filas_sin_repetir(filas, modelo.objects.filter(
+            Q(cedula__in=cedulas) | Q(telefono__in=[fila['telefono'] for fila in filas])).values_list('cedula', 'telefono'))
+        if nuevas:
+            inicio, _ = Secuencia.reservar_bloque(secuencia, lambda: modelo.objects.filter(
+                identificacion__startswith=prefijo).count(), len(nuevas))
+            modelo.objects.bulk_create([modelo(cedula=fila['cedula'], nombre=fila['nombre'], telefono=fila['telefono'],
+                                               identificacion=f"{prefijo}{fila['nombre'][0].upper()}{inicio + posicion:02d}")
+                                        for posicion, fila in enumerate(nuevas, 1)])
+        getattr(restaurante, relacion).add(*modelo.objects.filter(cedula__in=cedulas))
+        return omitidas
+    return importar
+
+_IMPORTADORES = {
+    'clientes': _importar_clientes,
+    'platos': _importar_platos,
+    'mesas': _importar_mesas,
+    'meseros': _importar_empleados(Mesero, '11M', 'mesero', 'meseros'),
+    'personal_cocina': _importar_empleados(PersonalCocina, '11P', 'personal_cocina', 'personal_cocina_list'),
+}
+
+def importar_entidad(restaurante: 'Restaurante', entidad: str, ruta: str, tamano=1000) -> int:
+    # Lee el archivo por lotes de tamano filas; cada lote y su punto de control (PuntoControlImportacion con
+    # las filas ya importadas) se guardan en la misma transaccion, asi que tras un fallo basta con volver a
+    # llamar con el mismo archivo para continuar desde el ultimo lote confirmado. El punto de control se
+    # identifica por entidad, restaurante y archivo (ruta, tamano y fecha de modificacion): otro archivo, o
+    # el mismo ya modificado, empieza desde cero. Al terminar se borra el punto de control.
+    importador = _IMPORTADORES[entidad]
+    archivo = os.stat(ruta)
+    punto_control = PuntoControlImportacion.objects.filter(
+        restaurante=restaurante, entidad=entidad, ruta=os.path.abspath(ruta), tamano=archivo.st_size,
+        modificado_ns=archivo.st_mtime_ns)
+    procesadas = punto_control.values_list('procesadas', flat=True).first() or 0
+    filas = itertools.islice(leer_filas(ruta), procesadas, None)
+    while True:
+        lote = list(itertools.islice(filas, tamano))
+        if not lote:
+            break
+        with transaction.atomic(using=alias_de_escritura(Restaurante, restaurante)):
+            omitidas = importador(restaurante, lote)
+            procesadas += len(lote)
+            if not punto_control.update(procesadas=procesadas):
+                PuntoControlImportacion.objects.create(
+                    restaurante=restaurante, entidad=entidad, ruta=os.path.abspath(ruta), tamano=archivo.st_size,
+                    modificado_ns=archivo.st_mtime_ns, procesadas=procesadas)
+        if omitidas:
+            emitir(FilasOmitidas(entidad, omitidas))
+        emitir(TransferenciaAvanzada('Importacion', entidad, procesadas))
+    punto_control.delete()
+    return procesadas
+
+def exportar_entidad(restaurante: 'Restaurante', entidad: str, ruta: str, tamano=1000) -> int:
+    consultas = {
+        'clientes': lambda: restaurante.clientes.all(),
+        'platos': lambda: restaurante.menu.platos.all(),
+        'mesas': lambda: restaurante.mesas.all(),
+        'meseros': lambda: restaurante.meseros.all(),
+        'personal_cocina': lambda: restaurante.personal_cocina_list.all(),
+    }
+    campos = CAMPOS_TRANSFERENCIA[entidad]
+    filas = consultas[entidad]().using(alias_de_reporte()).order_by('pk').values(*campos).iterator(chunk_size=tamano)
+    exportadas = 0
+    with open(ruta, 'w', newline='', encoding='utf-8') as archivo:
+        if ruta.endswith('.csv'):
+            escritor = csv.DictWriter(archivo, fieldnames=campos)
+            escritor.writeheader()
+            escribir = escritor.writerow
+        else:
+            escribir = lambda fila: archivo.write(json.dumps(fila, default=str, ensure_ascii=False) + '\n')
+        for fila in filas:
+            escribir(fila)
+            exportadas += 1
+            if exportadas % tamano == 0:
+                emitir(TransferenciaAvanzada('Exportacion', entidad, exportadas))
+    emitir(TransferenciaAvanzada('Exportacion', entidad, exportadas))
+    return exportadas
+
+#Enrutadores:
+def alias_de_escritura(modelo, instancia=None) -> str:
+    # Base en la que los routers escriben el modelo (o la instancia): las transacciones que agrupan esas
+    # escrituras deben abrirse sobre ese mismo alias, o dejan de ser atomicas al activar RouterRestaurantes.
+    return router.db_for_write(modelo, instance=instancia)
+
+_restaurante_actual = contextvars.ContextVar('restaurante_actual', default=None)
+
+@contextlib.contextmanager
+def en_restaurante(restaurante_id):
+    # Todo lo que se consulte o escriba dentro del bloque va a la base del restaurante indicado.
+    token = _restaurante_actual.set(restaurante_id)
+    try:
+        yield
+    finally:
+        _restaurante_actual.reset(token)
+
+class RouterRestaurantes:
+    # Opcional: con settings.BASES_POR_RESTAURANTE = {id_restaurante: alias} cada local guarda sus datos
+    # operativos en su propia base. Los objetos ya cargados siguen en la base de la que vinieron. Los modelos
+    # sin restaurante (Secuencia, Historial, Menu, ...) solo se enrutan dentro de en_restaurante(), asi que las
+    # operaciones de un local deben correr dentro de ese bloque; las transacciones usan alias_de_escritura().
+    def _alias(self, hints):
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db and instancia._state.db != getattr(settings, 'BASE_REPLICA', None):
+            return instancia._state.db
+        restaurante_id = _restaurante_actual.get()
+        if restaurante_id is None and instancia is not None:
+            restaurante_id = instancia.pk if isinstance(instancia, Restaurante) else getattr(instancia, 'restaurante_id', None)
+        return getattr(settings, 'BASES_POR_RESTAURANTE', {}).get(restaurante_id)
+
+    def db_for_read(self, model, **hints):
+        return self._alias(hints)
+
+    def db_for_write(self, model, **hints):
+        return self._alias(hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return obj1._state.db == obj2._state.db
+
+# Replica de lectura para reportes. Configuracion:
+#     DATABASES = {'default': {...}, 'replica': {...}}
+#     DATABASE_ROUTERS = ['<app>.models.RouterReplica', '<app>.models.RouterRestaurantes']
+#     BASE_REPLICA = 'replica'        # copia de 'default'
+#     REPLICA_TOLERANCIA_S = 2   # retraso maximo esperado de la replica
+# En local, dos archivos SQLite hacen de primaria y replica; copiar_a_replica() "replica" el estado actual.
+_en_reporte = contextvars.ContextVar('en_reporte', default=False)
+_en_primaria = contextvars.ContextVar('en_primaria', default=False)
+_ultima_escritura = contextvars.ContextVar('ultima_escritura', default=None)
+
+@contextlib.contextmanager
+def en_reporte():
+    token = _en_reporte.set(True)
+    try:
+        yield
+    finally:
+        _en_reporte.reset(token)
+
+@contextlib.contextmanager
+def en_primaria():
+    # Fuerza la primaria aunque el bloque sea de reporte (p. ej. el recibo que se muestra tras cobrar).
+    token = _en_primaria.set(True)
+    try:
+        yield
+    finally:
+        _en_primaria.reset(token)
+
+def alias_de_reporte():
+    # La replica solo se usa si no se escribio desde este contexto dentro de la tolerancia: asi quien acaba
+    # de escribir lee lo que escribio. None deja la decision al resto de routers (la primaria).
+    alias = getattr(settings, 'BASE_REPLICA', None)
+    if alias is None or _en_primaria.get():
+        return None
+    ultima = _ultima_escritura.get()
+    if ultima is not None and time.monotonic() - ultima < getattr(settings, 'REPLICA_TOLERANCIA_S', 2):
+        return None
+    return alias
+
+def copiar_a_replica(origen='default'):
+    primaria, replica = connections[origen], connections[settings.BASE_REPLICA]
+    primaria.ensure_connection()
+    replica.ensure_connection()
+    primaria.connection.backup(replica.connection)
+
+class RouterReplica:
+    def db_for_read(self, model, **hints):
+        return alias_de_reporte() if _en_reporte.get() else None
+
+    def db_for_write(self, model, **hints):
+        _ultima_escritura.set(time.monotonic())
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db == getattr(settings, 'BASE_REPLICA', None):
+            # Un objeto leido en un reporte nunca se guarda en la replica.
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Un objeto leido de la replica es la misma fila que en la primaria.
+        replica = getattr(settings, 'BASE_REPLICA', None)
+        if replica in (obj1._state.db, obj2._state.db):
+            return True
+        return None
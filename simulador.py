@@ -0,0 +1,304 @@
+#Simulador de capacidad del flujo de Restaurante, sin base de datos.
+#Reproduce las reglas de juan.py:
+#    asignar_mesa    -> mesa libre de capacidad n o n+1, la mas ajustada primero; si no hay, el grupo espera y
+#                       la mesa que se libera pasa al grupo de capacidad o capacidad-1 que llego antes
+#    atender_pedido  -> el primer Mesero libre toma el pedido
+#    preparar_pedido -> el cocinero que queda libre antes suma el tiempo_preparacion de cada plato
+#simular_noche() es la simulacion por eventos (Python puro, una noche); montecarlo() corre miles de noches
+#a la vez con NumPy, avanzando todas las noches grupo por grupo en orden de llegada.
+#Uso:
+#    python simulador.py --mesas 2x10 4x8 6x2 --meseros 4 --cocineros 3 --tasas 20 30 40 --noches 5000
+#    python simulador.py --mesas 2x10 4x8 --verificar 200
+import argparse
+import heapq
+import json
+import random
+import sys
+from collections import deque
+
+PERCENTILES = (50, 90, 99)
+
+
+class Mesa:
+    __slots__ = ('numero', 'capacidad', 'libre', 'ocupada')
+
+    def __init__(self, numero: int, capacidad: int):
+        self.numero = numero
+        self.capacidad = capacidad
+        self.libre = True
+        self.ocupada = 0.0
+
+
+class Recurso:
+    # Un mesero o un cocinero: minuto en que queda libre y minutos trabajados.
+    __slots__ = ('libre_en', 'ocupado')
+
+    def __init__(self):
+        self.libre_en = 0.0
+        self.ocupado = 0.0
+
+
+class Grupo:
+    __slots__ = ('llegada', 'personas', 'preparacion', 'comida', 'mesa', 'sentado', 'pedido', 'listo')
+
+    def __init__(self, llegada: float, personas: int, preparacion: float, comida: float):
+        self.llegada = llegada
+        self.personas = personas
+        self.preparacion = preparacion
+        self.comida = comida
+        self.mesa = None
+        self.sentado = None
+        self.pedido = None
+        self.listo = None
+
+
+class Escenario:
+    __slots__ = ('mesas', 'meseros', 'cocineros', 'tasa', 'horas', 'grupos', 'platos', 'decision', 'atencion', 'comida')
+
+    def __init__(self, mesas, meseros, cocineros, tasa, horas=4.0, grupos=None, platos=None,
+                 decision=5.0, atencion=3.0, comida=45.0):
+        self.mesas = sorted(mesas)              # capacidades; el orden (capacidad, numero) es el de reclamar_mesa
+        self.meseros = meseros
+        self.cocineros = cocineros
+        self.tasa = tasa                        # grupos por hora
+        self.horas = horas
+        self.grupos = grupos or {1: 0.15, 2: 0.4, 3: 0.15, 4: 0.2, 5: 0.05, 6: 0.05}   # personas -> probabilidad
+        self.platos = platos or {10: 0.4, 15: 0.3, 25: 0.2, 40: 0.1}                   # minutos de preparacion -> probabilidad
+        self.decision = decision                # minutos desde que se sienta hasta que pide
+        self.atencion = atencion                # minutos de mesero por pedido
+        self.comida = comida                    # minutos medios en la mesa tras recibir la comida
+
+    def sortear_grupo(self, azar: random.Random, llegada: float) -> Grupo:
+        personas = azar.choices(list(self.grupos), weights=list(self.grupos.values()))[0]
+        # Un plato por persona; preparar_pedido suma el tiempo de cada item.
+        preparacion = sum(azar.choices(list(self.platos), weights=list(self.platos.values()), k=personas))
+        return Grupo(llegada, personas, preparacion, azar.expovariate(1 / self.comida))
+
+
+def simular_noche(escenario: Escenario, semilla=None) -> dict:
+    azar = random.Random(semilla)
+    duracion = escenario.horas * 60
+    mesas = [Mesa(numero, capacidad) for numero, capacidad in enumerate(escenario.mesas, 1)]
+    meseros = [Recurso() for _ in range(escenario.meseros)]
+    cocineros = [Recurso() for _ in range(escenario.cocineros)]
+    eventos, orden = [], 0
+    grupos, espera_mesa, cola_meseros = [], [], deque()
+
+    def programar(tiempo, tipo, dato):
+        nonlocal orden
+        heapq.heappush(eventos, (tiempo, orden, tipo, dato))
+        orden += 1
+
+    def sentar(grupo, mesa, tiempo):
+        mesa.libre = False
+        grupo.mesa, grupo.sentado = mesa, tiempo
+        programar(tiempo + escenario.decision, 'pedido', grupo)
+
+    def atender(grupo, mesero, tiempo):
+        grupo.pedido = tiempo
+        mesero.libre_en = tiempo + escenario.atencion
+        mesero.ocupado += escenario.atencion
+        programar(mesero.libre_en, 'mesero_libre', mesero)
+        cocinero = min(cocineros, key=lambda recurso: recurso.libre_en)
+        inicio = max(cocinero.libre_en, mesero.libre_en)
+        cocinero.libre_en = inicio + grupo.preparacion
+        cocinero.ocupado += grupo.preparacion
+        programar(cocinero.libre_en, 'comida_lista', grupo)
+
+    tiempo = azar.expovariate(escenario.tasa / 60)
+    while tiempo < duracion:
+        programar(tiempo, 'llegada', escenario.sortear_grupo(azar, tiempo))
+        tiempo += azar.expovariate(escenario.tasa / 60)
+
+    while eventos:
+        tiempo, _, tipo, dato = heapq.heappop(eventos)
+        if tipo == 'llegada':
+            grupos.append(dato)
+            mesa = next((mesa for mesa in mesas if mesa.libre and mesa.capacidad in (dato.personas, dato.personas + 1)), None)
+            if mesa is not None:
+                sentar(dato, mesa, tiempo)
+            else:
+                espera_mesa.append(dato)
+        elif tipo == 'pedido':
+            mesero = next((mesero for mesero in meseros if mesero.libre_en <= tiempo), None)
+            if mesero is not None:
+                atender(dato, mesero, tiempo)
+            else:
+                cola_meseros.append(dato)
+        elif tipo == 'mesero_libre':
+            if cola_meseros and dato.libre_en <= tiempo:
+                atender(cola_meseros.popleft(), dato, tiempo)
+        elif tipo == 'comida_lista':
+            dato.listo = tiempo
+            programar(tiempo + dato.comida, 'mesa_libre', dato)
+        else:
+            mesa = dato.mesa
+            mesa.libre = True
+            mesa.ocupada += tiempo - dato.sentado
+            siguiente = next((grupo for grupo in espera_mesa if grupo.personas in (mesa.capacidad, mesa.capacidad - 1)), None)
+            if siguiente is not None:
+                espera_mesa.remove(siguiente)
+                sentar(siguiente, mesa, tiempo)
+
+    horizonte = max([duracion] + [grupo.listo + grupo.comida for grupo in grupos if grupo.listo is not None])
+    atendidos = [grupo for grupo in grupos if grupo.listo is not None]
+    return {
+        'grupos': len(grupos),
+        'sin_mesa': len(grupos) - len(atendidos),
+        'espera_mesa': [grupo.sentado - grupo.llegada for grupo in atendidos],
+        'espera_comida': [grupo.listo - grupo.llegada for grupo in atendidos],
+        'uso_mesas': sum(mesa.ocupada for mesa in mesas) / (len(mesas) * horizonte) if mesas else 0.0,
+        'uso_meseros': sum(mesero.ocupado for mesero in meseros) / (len(meseros) * horizonte) if meseros else 0.0,
+        'uso_cocina': sum(cocinero.ocupado for cocinero in cocineros) / (len(cocineros) * horizonte) if cocineros else 0.0,
+    }
+
+
+def montecarlo(escenario: Escenario, noches: int, semilla=None) -> dict:
+    # Todas las noches avanzan juntas: en el paso k cada noche atiende a su k-esimo grupo con operaciones
+    # sobre matrices (noches x mesas, noches x meseros, noches x cocineros). Meseros y cocina se asignan en
+    # orden de llegada, no de pedido; simular_noche() sirve para contrastar esa aproximacion.
+    import numpy as np
+
+    azar = np.random.default_rng(semilla)
+    duracion = escenario.horas * 60
+    capacidades = np.array(escenario.mesas)
+    tamanos, prob_tamanos = np.array(list(escenario.grupos)), np.array(list(escenario.grupos.values()), dtype=float)
+    tiempos_platos, prob_platos = np.array(list(escenario.platos), dtype=float), np.array(list(escenario.platos.values()), dtype=float)
+
+    cantidades = azar.poisson(escenario.tasa * escenario.horas, noches)
+    maximo = max(int(cantidades.max()), 1)
+    llegadas = azar.uniform(0, duracion, (noches, maximo))
+    llegadas[np.arange(maximo) >= cantidades[:, None]] = np.inf
+    llegadas.sort(axis=1)
+    personas = azar.choice(tamanos, p=prob_tamanos / prob_tamanos.sum(), size=(noches, maximo))
+    platos = azar.choice(tiempos_platos, p=prob_platos / prob_platos.sum(), size=(noches, maximo, tamanos.max()))
+    preparacion = (platos * (np.arange(tamanos.max()) < personas[..., None])).sum(axis=2)
+    comida = azar.exponential(escenario.comida, (noches, maximo))
+
+    filas = np.arange(noches)
+    mesas = np.zeros((noches, len(capacidades)))
+    meseros = np.zeros((noches, escenario.meseros))
+    cocineros = np.zeros((noches, escenario.cocineros))
+    uso_mesas, uso_meseros, uso_cocina = np.zeros(noches), np.zeros(noches), np.zeros(noches)
+    espera_mesa = np.full((noches, maximo), np.nan)
+    espera_comida = np.full((noches, maximo), np.nan)
+    horizonte = np.full(noches, duracion)
+
+    for k in range(maximo):
+        llegada, tamano = llegadas[:, k], personas[:, k]
+        elegibles = (capacidades == tamano[:, None]) | (capacidades == tamano[:, None] + 1)
+        # Mesa que primero queda disponible para el grupo; con empate gana la mas ajustada (orden capacidad, numero).
+        inicio = np.where(elegibles, np.maximum(mesas, llegada[:, None]), np.inf)
+        mesa = inicio.argmin(axis=1)
+        sentado = inicio[filas, mesa]
+        atendido = np.isfinite(sentado)
+        if not atendido.any():
+            continue
+        pide = sentado + escenario.decision
+        libres = meseros <= pide[:, None]
+        mesero = np.where(libres.any(axis=1), libres.argmax(axis=1), meseros.argmin(axis=1))
+        pedido = np.maximum(meseros[filas, mesero], pide)
+        cocinero = cocineros.argmin(axis=1)
+        listo = np.maximum(cocineros[filas, cocinero], pedido + escenario.atencion) + preparacion[:, k]
+        salida = listo + comida[:, k]
+
+        # Las noches sin grupo en este paso tienen llegada y salida infinitas: se filtran antes de restar.
+        n, m, me, c = filas[atendido], mesa[atendido], mesero[atendido], cocinero[atendido]
+        llegada, sentado, listo, salida = llegada[atendido], sentado[atendido], listo[atendido], salida[atendido]
+        mesas[n, m] = salida
+        meseros[n, me] = pedido[atendido] + escenario.atencion
+        cocineros[n, c] = listo
+        uso_mesas[n] += salida - sentado
+        uso_meseros[n] += escenario.atencion
+        uso_cocina[n] += preparacion[n, k]
+        espera_mesa[n, k] = sentado - llegada
+        espera_comida[n, k] = listo - llegada
+        horizonte[n] = np.maximum(horizonte[n], salida)
+
+    validas = np.isfinite(llegadas)
+    return {
+        'noches': noches,
+        'grupos': int(validas.sum()),
+        'sin_mesa': int((validas & np.isnan(espera_mesa)).sum()),
+        'espera_mesa': espera_mesa[~np.isnan(espera_mesa)],
+        'espera_comida': espera_comida[~np.isnan(espera_comida)],
+        'uso_mesas': uso_mesas / (max(len(capacidades), 1) * horizonte),
+        'uso_meseros': uso_meseros / (max(escenario.meseros, 1) * horizonte),
+        'uso_cocina': uso_cocina / (max(escenario.cocineros, 1) * horizonte),
+    }
+
+
+def percentiles(valores) -> dict:
+    import numpy as np
+
+    valores = np.asarray(valores, dtype=float)
+    if not valores.size:
+        return {f'p{p}': None for p in PERCENTILES}
+    return {f'p{p}': float(v) for p, v in zip(PERCENTILES, np.percentile(valores, PERCENTILES))}
+
+
+def reporte(resultado: dict) -> dict:
+    return {
+        'grupos': resultado['grupos'],
+        'sin_mesa_pct': 100 * resultado['sin_mesa'] / max(resultado['grupos'], 1),
+        **{clave: percentiles(resultado[clave])
+           for clave in ('espera_mesa', 'espera_comida', 'uso_mesas', 'uso_meseros', 'uso_cocina')},
+    }
+
+
+def leer_mesas(valores: list) -> list:
+    # "4x8" son 8 mesas de 4 personas; "4" es una sola mesa.
+    mesas = []
+    for valor in valores:
+        capacidad, _, cantidad = valor.partition('x')
+        mesas += [int(capacidad)] * int(cantidad or 1)
+    return mesas
+
+
+def leer_distribucion(valores: list) -> dict:
+    # "10:0.4" -> valor 10 con probabilidad 0.4
+    return {int(valor): float(probabilidad) for valor, probabilidad in (par.split(':') for par in valores)} or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador de capacidad del flujo de Restaurante")
+    parser.add_argument('--mesas', nargs='+', required=True, metavar='CAPACIDADxCANTIDAD')
+    parser.add_argument('--meseros', type=int, default=4)
+    parser.add_argument('--cocineros', type=int, default=3)
+    parser.add_argument('--tasas', nargs='+', type=float, default=[20, 30, 40], help="Grupos por hora a simular")
+    parser.add_argument('--horas', type=float, default=4)
+    parser.add_argument('--grupos', nargs='*', default=[], metavar='PERSONAS:PROBABILIDAD')
+    parser.add_argument('--platos', nargs='*', default=[], metavar='MINUTOS:PROBABILIDAD')
+    parser.add_argument('--comida', type=float, default=45, help="Minutos medios en la mesa tras recibir la comida")
+    parser.add_argument('--noches', type=int, default=5000)
+    parser.add_argument('--semilla', type=int)
+    parser.add_argument('--verificar', type=int, metavar='NOCHES', help="Compara con la simulacion por eventos")
+    parser.add_argument('--salida', default='-', help="Archivo JSON de resultados ('-' para stdout)")
+    args = parser.parse_args(argv)
+
+    resultados = []
+    for tasa in args.tasas:
+        escenario = Escenario(leer_mesas(args.mesas), args.meseros, args.cocineros, tasa, args.horas,
+                              leer_distribucion(args.grupos), leer_distribucion(args.platos), comida=args.comida)
+        resultado = {'tasa': tasa, 'montecarlo': reporte(montecarlo(escenario, args.noches, args.semilla))}
+        if args.verificar:
+            noches = [simular_noche(escenario, None if args.semilla is None else args.semilla + i) for i in range(args.verificar)]
+            resultado['eventos'] = reporte({
+                'grupos': sum(noche['grupos'] for noche in noches),
+                'sin_mesa': sum(noche['sin_mesa'] for noche in noches),
+                **{clave: [valor for noche in noches for valor in noche[clave]] for clave in ('espera_mesa', 'espera_comida')},
+                **{clave: [noche[clave] for noche in noches] for clave in ('uso_mesas', 'uso_meseros', 'uso_cocina')},
+            })
+        resultados.append(resultado)
+
+    contenido = json.dumps(resultados, indent=2)
+    if args.salida == '-':
+        print(contenido)
+    else:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(contenido)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())